@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+#
+# restest benchmarks
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+# Runs the scripts in benchmarks/scripts against a local stub server and
+# reports, for every scenario:
+#
+#   - requests:  number of requests sent
+#   - req/s:     throughput
+#   - overhead:  client time per request (everything but the HTTP round trip), in µs
+#   - rss:       peak memory of the process, in MB
+#
+# Every scenario runs in its own process, `--rounds` times: the best round is kept.
+# Results are compared with benchmarks/baseline.json (see --save and --check).
+#
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SCRIPTS_DIR = os.path.join(BENCH_DIR, "scripts")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+sys.path.insert(0, ROOT_DIR)
+
+# name: (script, logging)
+SCENARIOS = {
+    "small": ("small.json", False),
+    "large-body": ("large_body.json", False),
+    "deep-paths": ("deep_paths.json", False),
+    "templating": ("templating.json", False),
+    "repeat": ("repeat.json", False),
+    "repeat-log": ("repeat.json", True),
+}
+
+# metric: True if higher is better
+METRICS = {
+    "rps": True,
+    "overhead_us": False,
+    "rss_mb": False,
+}
+
+
+def _rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, KB everywhere else
+    if sys.platform == "darwin":
+        return rss / (1024 * 1024)
+
+    return rss / 1024
+
+
+def run_scenario(name):
+    # runs a single round of a scenario in this process
+    from lib.parser import RESTestParser
+    from server import StubServer
+
+    script, logging = SCENARIOS[name]
+
+    server = StubServer().start()
+    tmp = tempfile.mkdtemp(prefix="restest-bench-")
+
+    try:
+        p = RESTestParser(
+            base_url=server.url,
+            log_file=os.path.join(tmp, "bench.log") if logging else None,
+            quiet=True,
+            no_colors=True,
+            cache_dir="",
+        )
+
+        # the time spent in _send() is the HTTP round trip, everything else is overhead
+        net = [0.0]
+        send = p.rt._send
+
+        def timed_send(req):
+            t = time.perf_counter()
+            try:
+                return send(req)
+            finally:
+                net[0] += time.perf_counter() - t
+
+        p.rt._send = timed_send
+
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                p.open(os.path.join(SCRIPTS_DIR, script))
+                wall = time.perf_counter() - start
+                p.close()
+
+        count = len(p.timings)
+    finally:
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "requests": count,
+        "errors": p.rt._errors,
+        "wall": wall,
+        "rps": count / wall,
+        "overhead_us": (wall - net[0]) / count * 1000000,
+        "rss_mb": _rss_mb(),
+    }
+
+
+def run_rounds(name, rounds):
+    best = None
+
+    for _ in range(rounds):
+        res = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", name],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if res.returncode:
+            sys.stderr.write("ERROR: scenario %s failed\n" % name)
+            sys.exit(1)
+
+        data = json.loads(res.stdout)
+        if best is None or data["overhead_us"] < best["overhead_us"]:
+            best = data
+
+    return best
+
+
+def compare(name, res, baseline, tolerance):
+    # returns a description of the changes and the list of regressions
+    base = baseline.get("scenarios", {}).get(name)
+    if not base:
+        return "(no baseline)", []
+
+    notes = []
+    regressions = []
+
+    for metric, higher_is_better in METRICS.items():
+        if not base.get(metric):
+            continue
+
+        delta = res[metric] / base[metric] - 1
+        notes.append("%s %+.1f%%" % (metric, delta * 100))
+
+        if (delta < -tolerance) if higher_is_better else (delta > tolerance):
+            regressions.append("%s: %s %+.1f%%" % (name, metric, delta * 100))
+
+    return ", ".join(notes), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="restest benchmarks")
+    parser.add_argument(
+        "scenario",
+        nargs="*",
+        help="Scenarios to run (defaults to all): %s" % ", ".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=3, help="Rounds per scenario (defaults to 3)"
+    )
+    parser.add_argument(
+        "--baseline", type=str, default=BASELINE, help="Baseline file to compare with"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with an error if any metric is worse than the baseline by more than the tolerance",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.15,
+        help="Tolerance used by --check (defaults to 0.15, ie. 15%%)",
+    )
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child)))
+        return
+
+    names = args.scenario or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario: %s" % name)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(
+        "%-12s %9s %10s %14s %9s   %s"
+        % ("scenario", "requests", "req/s", "overhead (µs)", "rss (MB)", "vs baseline")
+    )
+
+    results = {}
+    regressions = []
+
+    for name in names:
+        res = run_rounds(name, args.rounds)
+        results[name] = res
+
+        notes, regs = compare(name, res, baseline, args.tolerance)
+        regressions.extend(regs)
+
+        print(
+            "%-12s %9s %10.1f %14.1f %9.1f   %s"
+            % (name, res["requests"], res["rps"], res["overhead_us"], res["rss_mb"], notes)
+        )
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "scenarios": results,
+                },
+                f,
+                indent=4,
+            )
+            f.write("\n")
+
+    if regressions:
+        print("\nREGRESSIONS:\n  %s" % "\n  ".join(regressions))
+
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
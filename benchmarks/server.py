@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# restest benchmarks - stub HTTP server
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import functools
+import json
+import socket
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@functools.lru_cache(maxsize=None)
+def _small():
+    return json.dumps(
+        {"id": 1, "name": "bench", "token": "abc", "user": {"id": 7, "name": "bob"}}
+    ).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=None)
+def _big(n):
+    return json.dumps(
+        {
+            "count": n,
+            "items": [
+                {"id": i, "name": "item %s" % i, "price": i * 3, "tags": ["a", "b"]}
+                for i in range(n)
+            ],
+        }
+    ).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=None)
+def _deep(depth):
+    node = {"value": depth, "items": [{"id": i, "name": "n%s" % i} for i in range(10)]}
+    for i in range(depth - 1, -1, -1):
+        node = {"value": i, "child": node}
+
+    return json.dumps(node).encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately: do not wait for the client ACK
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _drain(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n:
+            self.rfile.read(n)
+
+    def do_GET(self):
+        self._drain()
+
+        url = urllib.parse.urlparse(self.path)
+        qs = urllib.parse.parse_qs(url.query)
+
+        if url.path == "/big":
+            return self._reply(_big(int(qs.get("n", ["1000"])[0])))
+
+        if url.path == "/deep":
+            return self._reply(_deep(int(qs.get("depth", ["20"])[0])))
+
+        self._reply(_small())
+
+    def do_POST(self):
+        self._drain()
+        self._reply(_small())
+
+    do_PUT = do_POST
+    do_PATCH = do_POST
+    do_DELETE = do_GET
+
+
+class StubServer:
+    """
+    A local HTTP server, running in a background thread, answering with
+    canned JSON documents:
+
+        - /big?n=1000     a list of `n` items
+        - /deep?depth=20  a document nested `depth` levels
+        - anything else   a small document (POST, PUT and PATCH bodies are discarded)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="restest-bench", daemon=True
+        )
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
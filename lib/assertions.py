@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+#
+# restest assertions
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import importlib.util
+import itertools
+import json
+import math
+import os
+
+from .cols import xcolored as _c
+
+# compiled tests kept in memory
+ASSERTION_CACHE_SIZE = 4096
+
+# mode name (and aliases) -> Mode
+_modes = {}
+
+# (mode, value, save) -> Assertion
+_cache = {}
+
+_plugins = set()
+
+# NumPy (optional) is imported only when a collection test needs it (see _numpy)
+numpy = None
+_numpy_imported = False
+
+
+class Mode:
+    """
+    A test mode.
+
+    `predicate(current, expected)` returns True when the test passes.
+    `message` is the error message: a string formatted with the (colored)
+    field name, expected value and current value, or a callable
+    `message(rt, field, expected, current)` returning it. Messages are built
+    only when a test fails.
+    The current value of `collection` modes is not expanded (it is a list,
+    possibly a big one).
+    """
+
+    __slots__ = ("name", "predicate", "message", "collection")
+
+    def __init__(self, name, predicate, message, collection=False):
+        self.name = name
+        self.predicate = predicate
+        self.message = message
+        self.collection = collection
+
+    def error(self, rt, field, expected, current):
+        if callable(self.message):
+            return self.message(rt, field, expected, current)
+
+        return self.message % (
+            _c(rt, field, "white"),
+            _c(rt, expected, "yellow"),
+            _c(rt, current, "red"),
+        )
+
+
+def register_assertion(names, predicate, message, collection=False):
+    """
+    Registers a test mode (this is also the plugin API, see load_plugin()).
+
+    `names` is the mode name, or a list with the name and its aliases
+    (they are case insensitive). See Mode for the other arguments.
+    """
+    if isinstance(names, str):
+        names = [names]
+
+    mode = Mode(names[0].upper(), predicate, message, collection)
+    for name in names:
+        _modes[name.upper()] = mode
+
+    _cache.clear()
+
+
+def load_plugin(fname):
+    # runs a Python file that registers its own test modes (once)
+    fname = os.path.abspath(fname)
+    if fname in _plugins:
+        return
+
+    spec = importlib.util.spec_from_file_location(
+        "restest_plugin_%s" % len(_plugins), fname
+    )
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+
+    _plugins.add(fname)
+
+
+def _is_static(value):
+    # values with no %(...)s references do not need to be expanded
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str).find("%(") == -1
+
+    return str(value).find("%(") == -1
+
+
+class Assertion:
+    """
+    A test definition, compiled once: the mode is resolved, and the expected
+    value is expanded at every run only if it contains variables.
+    """
+
+    __slots__ = ("name", "mode", "value", "static")
+
+    def __init__(self, chk):
+        # mode is now case insensitive
+        self.name = chk.get("mode", "EQUALS").upper()
+        self.mode = _modes.get(self.name)
+        self.value = chk.get("value")
+        self.static = _is_static(self.value)
+
+    def run(self, rt, field, v):
+        # returns the error message, or None if the test passes
+        if self.mode is None:
+            return "ERROR: unsupported test mode: %s " % self.name
+
+        current = v if self.mode.collection else rt._expand_var(v)
+        expected = self.value if self.static else rt._expand_var(self.value)
+
+        if self.mode.predicate(current, expected):
+            return None
+
+        return self.mode.error(rt, field, expected, current)
+
+
+def compile_assertion(chk):
+    value = chk.get("value")
+    key = (chk.get("mode", "EQUALS"), type(value), value)
+
+    try:
+        a = _cache.get(key)
+    except TypeError:
+        # lists and dicts
+        key = (key[0], type(value), json.dumps(value, sort_keys=True, default=str))
+        a = _cache.get(key)
+
+    if a is None:
+        if len(_cache) >= ASSERTION_CACHE_SIZE:
+            _cache.clear()
+        a = _cache[key] = Assertion(chk)
+
+    return a
+
+
+# ==================================================================
+# built-in modes
+# ==================================================================
+
+
+def _num(v):
+    if isinstance(v, str):
+        return int(v)
+
+    return v
+
+
+def _is_empty(v):
+    return str(v) == "None" or len(str(v)) == 0
+
+
+def _object_compare(v1, v2):
+    o1 = v1 if isinstance(v1, dict) else eval(v1)
+    o2 = v2 if isinstance(v2, dict) else eval(v2)
+
+    k1 = list(o1.keys())
+    k2 = list(o2.keys())
+    k1.sort()
+    k2.sort()
+    if k1 != k2:
+        return False
+
+    for k in k1:
+        if o1[k] != o2[k]:
+            return False
+
+    return True
+
+
+def _msg_exists(rt, field, expected, current):
+    return "FIELD: %s is EMPTY" % _c(rt, field, "white")
+
+
+def _msg_empty(rt, field, expected, current):
+    return "FIELD: %s VALUE mismatch. Expected: Null - got: %s" % (
+        _c(rt, field, "white"),
+        _c(rt, current, "red"),
+    )
+
+
+def _msg_size(rt, field, expected, current):
+    return "FIELD: %s SIZE mismatch. Expected: %s - got: %s (%s)" % (
+        _c(rt, field, "white"),
+        _c(rt, expected, "yellow"),
+        _c(rt, len(current), "red"),
+        _c(rt, current, "yellow"),
+    )
+
+
+def _msg_object(rt, field, expected, current):
+    return "FIELD: %s object values mismatch" % _c(rt, field, "white")
+
+
+SMALLER = "FIELD: %s is SMALLER. Expected: %s got: %s"
+BIGGER = "FIELD: %s is BIGGER. Expected: %s got: %s"
+
+register_assertion(
+    ["EXISTS", "EXIST", "!!", "NOT_NULL", "IS_NOT_NULL"],
+    lambda c, e: not _is_empty(c),
+    _msg_exists,
+)
+register_assertion(
+    ["EMPTY", "IS_EMPTY", "IS_NULL", "NULL", "NOT_EXISTS", "NOT_EXIST", "@"],
+    lambda c, e: str(c) == "None",
+    _msg_empty,
+)
+register_assertion(
+    ["EQUALS", "==", "=", "EQUAL"],
+    lambda c, e: c == e or str(c) == str(e),
+    "FIELD: %s VALUE mismatch. Expected: %s - got: %s",
+)
+register_assertion(
+    ["NOT_EQUAL", "!=", "<>"],
+    lambda c, e: c != e,
+    "FIELD: %s VALUE mismatch. Expected difference: %s - got: %s",
+)
+register_assertion(
+    ["CONTAINS", "->"],
+    lambda c, e: e in c,
+    "FIELD: %s DOES NOT contains %s. List: %s",
+)
+register_assertion(
+    ["SIZE", "LEN", "LENGTH"], lambda c, e: len(c) == int(e), _msg_size
+)
+register_assertion(["GT", ">"], lambda c, e: _num(c) > e, SMALLER)
+register_assertion(["GTE", ">="], lambda c, e: _num(c) >= e, SMALLER)
+register_assertion(["LT", "<"], lambda c, e: _num(c) < e, BIGGER)
+register_assertion(["LTE", "<="], lambda c, e: _num(c) <= e, BIGGER)
+register_assertion(["SIZE-GT", "()>"], lambda c, e: len(c) > int(e), SMALLER)
+register_assertion(["SIZE-GTE", "()>="], lambda c, e: len(c) >= int(e), SMALLER)
+register_assertion(["SIZE-LT", "()<"], lambda c, e: len(c) < int(e), BIGGER)
+register_assertion(["SIZE-LTE", "()<="], lambda c, e: len(c) <= int(e), BIGGER)
+register_assertion(["OBJ", "OBJECT"], _object_compare, _msg_object)
+
+
+# ==================================================================
+# collection modes: the field is a list (ie. "items.[*].price")
+# ==================================================================
+
+# modes that can be run on a whole NumPy array at once
+_VECTOR_OPS = {
+    "EQUALS": "equal",
+    "NOT_EQUAL": "not_equal",
+    "GT": "greater",
+    "GTE": "greater_equal",
+    "LT": "less",
+    "LTE": "less_equal",
+}
+
+
+class _ElementError(Exception):
+    # an element of a collection that cannot be tested (ie. a null in a SUM)
+    def __init__(self, pos, value, err):
+        super().__init__(str(err))
+        self.pos = pos
+        self.value = value
+
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _json_value(v):
+    # "10" -> 10 (values may come from variables), "abc" -> "abc"
+    if not isinstance(v, str):
+        return v
+
+    try:
+        return json.loads(v)
+    except ValueError:
+        return v
+
+
+def _condition(value):
+    # "GT:0", "EXISTS" or { "mode": "GT", "value": 0 } -> (Mode, expected)
+    # (a string not starting with a mode name is a value: "active" is "EQUALS:active")
+    if isinstance(value, dict):
+        name = value.get("mode", "EQUALS")
+        expected = _json_value(value.get("value"))
+    elif isinstance(value, str):
+        name, sep, expected = value.partition(":")
+        if name.upper() not in _modes:
+            name, expected = "EQUALS", _json_value(value)
+        else:
+            expected = _json_value(expected) if sep else None
+    else:
+        name = "EQUALS"
+        expected = value
+
+    return _modes.get(name.upper()), expected
+
+
+def _numpy():
+    # imports NumPy at the first use: it is None if not installed
+    global numpy, _numpy_imported
+
+    if not _numpy_imported:
+        try:
+            import numpy as np
+        except ImportError:  # pragma: no cover
+            np = None
+
+        numpy = np
+        _numpy_imported = True
+
+    return numpy
+
+
+def _array(lst):
+    # a NumPy array of numbers, or None
+    if not lst or _numpy() is None:
+        return None
+
+    try:
+        a = numpy.asarray(lst)
+    except (ValueError, TypeError):
+        return None
+
+    if a.ndim != 1 or a.dtype.kind not in "iuf":
+        return None
+
+    return a
+
+
+def _matches(mode, current, expected):
+    # the condition on every element: the ones that cannot be tested with
+    # it (ie. null with GT) do not match, instead of stopping the run
+    for v in current:
+        try:
+            yield bool(mode.predicate(v, expected))
+        except (TypeError, ValueError):
+            yield False
+
+
+def _mask(current, mode, expected):
+    # True for every element matching the condition
+    op = _VECTOR_OPS.get(mode.name)
+    if op and _is_number(expected):
+        a = _array(current)
+        if a is not None:
+            return getattr(numpy, op)(a, expected)
+
+    return list(_matches(mode, current, expected))
+
+
+def _first(mask, value):
+    # position of the first element of the mask equal to value
+    for pos, v in enumerate(mask):
+        if bool(v) == value:
+            return pos
+
+    return -1
+
+
+def _all(current, expected):
+    mode, expected = _condition(expected)
+    if mode is None or not isinstance(current, list):
+        return False
+
+    op = _VECTOR_OPS.get(mode.name)
+    if op and _is_number(expected):
+        a = _array(current)
+        if a is not None:
+            return bool(getattr(numpy, op)(a, expected).all())
+
+    return all(_matches(mode, current, expected))
+
+
+def _any(current, expected):
+    mode, expected = _condition(expected)
+    if mode is None or not isinstance(current, list):
+        return False
+
+    op = _VECTOR_OPS.get(mode.name)
+    if op and _is_number(expected):
+        a = _array(current)
+        if a is not None:
+            return bool(getattr(numpy, op)(a, expected).any())
+
+    return any(_matches(mode, current, expected))
+
+
+def _compare(value, expected):
+    # COUNT and SUM: a number is compared for equality, anything else is a condition
+    if _is_number(expected):
+        if isinstance(value, float) or isinstance(expected, float):
+            return math.isclose(value, expected, rel_tol=1e-9)
+
+        return value == expected
+
+    mode, expected = _condition(expected)
+
+    return mode is not None and bool(mode.predicate(value, expected))
+
+
+def _sum(current):
+    # the builtin sum() is faster than converting the list to an array
+    try:
+        return sum(current)
+    except TypeError:
+        pass
+
+    # finds the element that cannot be added
+    total = 0
+    for pos, v in enumerate(current):
+        try:
+            total += v
+        except TypeError as e:
+            raise _ElementError(pos, v, e)
+
+    return total
+
+
+def _descending(expected):
+    return str(expected).upper() in ("DESC", "DESCENDING")
+
+
+def _unsorted(current, expected):
+    # position of the first element out of order, or -1
+    a = _array(current)
+    if a is not None:
+        ok = a[1:] <= a[:-1] if _descending(expected) else a[1:] >= a[:-1]
+        return -1 if ok.all() else _first(ok, False) + 1
+
+    pairs = zip(current, itertools.islice(current, 1, None))
+    for pos, (v1, v2) in enumerate(pairs):
+        try:
+            if (v2 > v1) if _descending(expected) else (v2 < v1):
+                return pos + 1
+        except TypeError as e:
+            # v1 has been compared already, unless it is the first element
+            if v1 is None:
+                raise _ElementError(pos, v1, e)
+            raise _ElementError(pos + 1, v2, e)
+
+    return -1
+
+
+def _duplicate(current):
+    # the first duplicated element, as a (value,) tuple, or None
+    # (a set is faster than numpy.unique(), that sorts the array)
+    seen = set()
+    for v in current:
+        k = v if isinstance(v, (str, int, float, bool, type(None))) else json.dumps(
+            v, sort_keys=True, default=str
+        )
+        if k in seen:
+            return (v,)
+        seen.add(k)
+
+    return None
+
+
+def _msg_collection(rt, field, expected, current, condition=True):
+    # common errors of the collection modes, or None
+    if not isinstance(current, list):
+        return "FIELD: %s is not a list (got: %s)" % (
+            _c(rt, field, "white"),
+            _c(rt, type(current).__name__, "red"),
+        )
+
+    if condition and isinstance(expected, (dict, str)):
+        mode, _ = _condition(expected)
+        if mode is None:
+            return "ERROR: unsupported test mode in: %s " % expected
+
+    return None
+
+
+def _msg_element(rt, field, err):
+    return "FIELD: %s: element [%s] = %s cannot be tested (%s)" % (
+        _c(rt, field, "white"),
+        err.pos,
+        _c(rt, err.value, "red"),
+        err,
+    )
+
+
+def _count(mask):
+    # number of matching elements
+    if numpy is not None and isinstance(mask, numpy.ndarray):
+        return int(mask.sum())
+
+    return sum(1 for v in mask if v)
+
+
+def _msg_all(rt, field, expected, current):
+    err = _msg_collection(rt, field, expected, current)
+    if err:
+        return err
+
+    mode, value = _condition(expected)
+    mask = _mask(current, mode, value)
+    pos = _first(mask, False)
+
+    return "FIELD: %s: %s of %s elements match %s (first failing: [%s] = %s)" % (
+        _c(rt, field, "white"),
+        _c(rt, _count(mask), "red"),
+        len(current),
+        _c(rt, expected, "yellow"),
+        pos,
+        _c(rt, current[pos], "red"),
+    )
+
+
+def _msg_any(rt, field, expected, current):
+    return _msg_collection(rt, field, expected, current) or (
+        "FIELD: %s: none of %s elements match %s"
+        % (_c(rt, field, "white"), len(current), _c(rt, expected, "yellow"))
+    )
+
+
+def _msg_count(rt, field, expected, current):
+    return _msg_collection(rt, field, expected, current) or (
+        "FIELD: %s COUNT mismatch. Expected: %s - got: %s"
+        % (
+            _c(rt, field, "white"),
+            _c(rt, expected, "yellow"),
+            _c(rt, len(current), "red"),
+        )
+    )
+
+
+def _msg_sum(rt, field, expected, current):
+    err = _msg_collection(rt, field, expected, current)
+    if err:
+        return err
+
+    try:
+        total = _sum(current)
+    except _ElementError as e:
+        return _msg_element(rt, field, e)
+
+    return "FIELD: %s SUM mismatch. Expected: %s - got: %s" % (
+        _c(rt, field, "white"),
+        _c(rt, expected, "yellow"),
+        _c(rt, total, "red"),
+    )
+
+
+def _msg_sorted(rt, field, expected, current):
+    err = _msg_collection(rt, field, expected, current, False)
+    if err:
+        return err
+
+    try:
+        pos = _unsorted(current, expected)
+    except _ElementError as e:
+        return _msg_element(rt, field, e)
+
+    return "FIELD: %s is NOT SORTED (%s): [%s] = %s - [%s] = %s" % (
+        _c(rt, field, "white"),
+        "DESC" if _descending(expected) else "ASC",
+        pos - 1,
+        _c(rt, current[pos - 1], "yellow"),
+        pos,
+        _c(rt, current[pos], "red"),
+    )
+
+
+def _msg_unique(rt, field, expected, current):
+    err = _msg_collection(rt, field, expected, current, False)
+    if err:
+        return err
+
+    return "FIELD: %s has DUPLICATES: %s" % (
+        _c(rt, field, "white"),
+        _c(rt, _duplicate(current)[0], "red"),
+    )
+
+
+def _is_list(fn):
+    # collection predicates fail on anything that is not a list, and on
+    # lists with elements that cannot be tested (see _ElementError)
+    def predicate(c, e):
+        if not isinstance(c, list):
+            return False
+
+        try:
+            return fn(c, e)
+        except _ElementError:
+            return False
+
+    return predicate
+
+
+register_assertion(["ALL"], _all, _msg_all, collection=True)
+register_assertion(["ANY"], _any, _msg_any, collection=True)
+register_assertion(
+    ["COUNT"],
+    _is_list(lambda c, e: _compare(len(c), e)),
+    _msg_count,
+    collection=True,
+)
+register_assertion(
+    ["SUM"],
+    _is_list(lambda c, e: _compare(_sum(c), e)),
+    _msg_sum,
+    collection=True,
+)
+register_assertion(
+    ["SORTED"],
+    _is_list(lambda c, e: _unsorted(c, e) == -1),
+    _msg_sorted,
+    collection=True,
+)
+register_assertion(
+    ["UNIQUE"],
+    _is_list(lambda c, e: _duplicate(c) is None),
+    _msg_unique,
+    collection=True,
+)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+#
+# restest async engine
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import asyncio
+import atexit
+import datetime
+import json
+import sys
+import threading
+import time
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from .engine import RESTest
+from .cols import xcolored as _c
+
+
+class AsyncRequest:
+    # mimics the bits of requests.PreparedRequest used by the engine (curl dump)
+    def __init__(self, method, url, headers, body):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+
+class AsyncResponse:
+    # mimics the bits of requests.Response used by the engine and the parser
+    def __init__(self, resp, content, elapsed, request):
+        self.status_code = resp.status
+        self.reason = resp.reason
+        self.url = str(resp.url)
+        self.headers = resp.headers
+        self.encoding = resp.charset or "utf-8"
+        self.content = content
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+        self.request = request
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncRESTest(RESTest):
+    """
+    An engine that issues the HTTP calls from an asyncio event loop.
+
+    All the engines (and the parallel workers forked from them) share one loop,
+    running in a background thread, and one pool of keep-alive connections.
+    The blocking do_EXEC() can be called from any thread, while coroutines
+    running on the loop can await do_EXEC_async() directly.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if aiohttp is None:
+            self.no_colors = kwargs.get("no_colors", False)
+            sys.stderr.write(
+                "%s: the async engine requires aiohttp (pip install aiohttp)\n"
+                % _c(self, "ERROR", "red")
+            )
+            sys.exit(1)
+
+        super().__init__(*args, **kwargs)
+
+        # max number of simultaneous connections (0 means no limit)
+        self.max_connections = 1000
+
+        self._sessions = {}
+
+        # shared by all the forks (even the ones forked before the loop is started):
+        # the loop, the connection pool and every session created
+        self._pool = {"loop": None, "thread": None, "connector": None, "sessions": []}
+
+    def fork(self):
+        w = super().fork()
+
+        # workers share the loop and the connection pool, but have their own cookies
+        w._sessions = {}
+        w._parent_cookies = self._sessions.get(False)
+
+        return w
+
+    @property
+    def loop(self):
+        pool = self._pool
+        if pool["loop"] is None:
+            pool["loop"] = asyncio.new_event_loop()
+            pool["thread"] = threading.Thread(
+                target=pool["loop"].run_forever, name="restest-loop", daemon=True
+            )
+            pool["thread"].start()
+
+            atexit.register(self.close)
+
+        return pool["loop"]
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        super().close()
+
+        pool = self._pool
+        if pool["loop"] is None:
+            return
+
+        self.run(self._aclose())
+        pool["loop"].call_soon_threadsafe(pool["loop"].stop)
+        pool["thread"].join()
+        pool["loop"].close()
+        pool["loop"] = None
+
+    async def _aclose(self):
+        for s in self._pool["sessions"]:
+            await s.close()
+
+        if self._pool["connector"]:
+            await self._pool["connector"].close()
+
+    async def _session(self, no_cookies):
+        s = self._sessions.get(no_cookies)
+        if s:
+            return s
+
+        if self._pool["connector"] is None:
+            self._pool["connector"] = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.pool_maxsize or 0,
+                force_close=not self.keep_alive,
+            )
+
+        if no_cookies:
+            jar = aiohttp.DummyCookieJar()
+        else:
+            jar = aiohttp.CookieJar(unsafe=True)
+            parent = getattr(self, "_parent_cookies", None)
+            if parent:
+                jar.update_cookies({m.key: m.value for m in parent.cookie_jar})
+
+        s = aiohttp.ClientSession(
+            connector=self._pool["connector"],
+            connector_owner=False,
+            cookie_jar=jar,
+            timeout=aiohttp.ClientTimeout(total=None),
+            trace_configs=[self._trace()],
+        )
+
+        self._sessions[no_cookies] = s
+        self._pool["sessions"].append(s)
+
+        return s
+
+    def _jar_cookies(self):
+        s = self._sessions.get(False) or getattr(self, "_parent_cookies", None)
+        if s is None:
+            return []
+
+        return [(m["domain"], m.key, m.value) for m in s.cookie_jar]
+
+    def _trace(self):
+        # updates the connection stats
+        stats = self.conn_stats
+
+        async def on_request(session, ctx, params):
+            stats.add(requests=1)
+
+        async def on_new_connection(session, ctx, params):
+            stats.add(new=1)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request)
+        trace.on_connection_create_end.append(on_new_connection)
+
+        return trace
+
+    async def _asend(self, req):
+        s = await self._session(req["no_cookies"])
+
+        if not req["no_cookies"]:
+            s.cookie_jar.update_cookies(req["cookies"])
+
+        mode = self._http_method(req["mode"]).upper()
+
+        # 2.4.0 - the whole request is cut at the run deadline
+        connect, read = self._timeouts(req)
+        timeout = aiohttp.ClientTimeout(
+            total=self.deadline.cap(None) if self.deadline else None,
+            sock_connect=connect,
+            sock_read=read,
+        )
+
+        start = time.perf_counter()
+
+        async with s.request(
+            mode,
+            req["url"],
+            data=req["body"],
+            headers=req["headers"],
+            timeout=timeout,
+        ) as resp:
+            content = await resp.read()
+
+        elapsed = time.perf_counter() - start
+
+        raw = req["body"] if isinstance(req["body"], bytes) else None
+        request = AsyncRequest(mode, req["url"], resp.request_info.headers, raw)
+
+        return AsyncResponse(resp, content, elapsed, request)
+
+    def _send(self, req):
+        return self.run(self._asend(req))
+
+    async def _asleep(self, seconds):
+        await self._adrive(self._pause(seconds))
+
+    async def _adrive(self, flow):
+        # the same as RESTest._drive(), for coroutines running on the loop
+        value = error = None
+        while True:
+            try:
+                if error is None:
+                    op, arg = flow.send(value)
+                else:
+                    op, arg = flow.throw(error)
+            except StopIteration as e:
+                return e.value
+
+            value = error = None
+            if op == "sleep":
+                await asyncio.sleep(arg)
+                continue
+
+            try:
+                value = await self._asend(arg)
+            except Exception as e:
+                error = e
+
+    async def _aexchange(self, req):
+        return await self._adrive(self._flow(req))
+
+    async def do_EXEC_async(
+        self,
+        meth,
+        endpoint,
+        data={},
+        authenticated=True,
+        status_code=200,
+        skip_error=False,
+        no_cookies=False,
+        max_exec_time=0,
+        files=None,
+        title="",
+        content="json",
+        headers=None,
+        cookies=None,
+        internal_info=None,
+        cache=None,
+        retry=None,
+        timeout=None,
+    ):
+        # NOTE: this runs on the event loop, so callers should disable
+        #       stop_on_error (or use skip_error) and check the status code
+        #       themselves: sys.exit() must not be called inside the loop
+        self._internal_info = internal_info
+
+        if self.delay:
+            await self._asleep(self.delay / 1000)
+
+        req = self._prepare(
+            meth,
+            endpoint,
+            data,
+            authenticated=authenticated,
+            no_cookies=no_cookies,
+            files=files,
+            content=content,
+            headers=headers,
+            cookies=cookies,
+        )
+
+        if req is None:
+            return None
+
+        req["cache"] = cache
+        req["retry"] = retry
+        req["timeout"] = timeout
+
+        t = self.profiler.start()
+        r = await self._aexchange(req)
+        self.profiler.stop("network", t + self.rate_wait_ns)
+
+        return self._finish(req, r, title, status_code, skip_error, max_exec_time)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+#
+# restest cassettes (record / replay)
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import base64
+import datetime
+import hashlib
+import json
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+class CassetteError(Exception):
+    pass
+
+
+def _key(method, url, data):
+    body = json.dumps(data, sort_keys=True, default=str)
+
+    return hashlib.sha1(
+        ("%s %s\n%s" % (method, url, body)).encode("utf-8")
+    ).hexdigest()
+
+
+class Cassette:
+    """
+    Request / response pairs stored in a JSONL file, one pair per line.
+
+    mode "record": every response received is appended (and flushed) to the file.
+
+    mode "replay": the file is loaded and indexed by method, URL and body, and
+    responses are served from it instead of the network. If the same request
+    has been recorded more than once, responses are served in the recorded
+    order, and the last one is repeated when they are over. Requests whose
+    body does not match (ie. bodies with timestamps) fall back to the
+    responses recorded for the same method and URL.
+    """
+
+    def __init__(self, fname, mode):
+        self.fname = fname
+        self.mode = mode
+        self.replaying = mode == "replay"
+
+        self._lock = threading.Lock()
+        self._fout = None
+
+        # key -> [entries, position]
+        self._exact = {}
+        self._loose = {}
+
+        if self.replaying:
+            self._load()
+        else:
+            self._fout = open(fname, "w", encoding="utf-8")
+
+    def _load(self):
+        with open(self.fname, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    e = json.loads(line)
+                    key = e["key"]
+                    req = e["request"]
+                    loose = "%s %s" % (req["method"], req["url"])
+                except (ValueError, KeyError, TypeError) as err:
+                    raise CassetteError(
+                        "%s: invalid entry at line %s (%s)" % (self.fname, n, err)
+                    )
+
+                self._exact.setdefault(key, [[], 0])[0].append(e)
+                self._loose.setdefault(loose, [[], 0])[0].append(e)
+
+    def record(self, req, r):
+        if self._fout is None:
+            return
+
+        e = {
+            "key": _key(req["mode"], req["url"], req["data"]),
+            "request": {
+                "method": req["mode"],
+                "url": req["url"],
+                "data": req["data"],
+            },
+            "response": {
+                "status": r.status_code,
+                "reason": r.reason,
+                "url": str(r.url),
+                "headers": [[k, v] for k, v in r.headers.items()],
+                "elapsed_ms": r.elapsed.total_seconds() * 1000,
+            },
+        }
+
+        try:
+            e["response"]["body"] = r.content.decode("utf-8")
+        except UnicodeDecodeError:
+            e["response"]["body_b64"] = base64.b64encode(r.content).decode("ascii")
+
+        line = json.dumps(e, ensure_ascii=False, default=str)
+
+        with self._lock:
+            self._fout.write(line + "\n")
+            self._fout.flush()
+
+    def replay(self, req):
+        e = self._next(self._exact.get(_key(req["mode"], req["url"], req["data"])))
+        if e is None:
+            e = self._next(self._loose.get("%s %s" % (req["mode"], req["url"])))
+        if e is None:
+            raise CassetteError(
+                "no response recorded for %s %s in %s"
+                % (req["mode"], req["url"], self.fname)
+            )
+
+        return self._response(req, e["response"])
+
+    def _next(self, slot):
+        if slot is None:
+            return None
+
+        with self._lock:
+            entries, pos = slot
+            slot[1] = min(pos + 1, len(entries) - 1)
+
+            return entries[pos]
+
+    def _response(self, req, rec):
+        r = requests.Response()
+
+        r.status_code = rec["status"]
+        r.reason = rec.get("reason", "")
+        r.url = rec.get("url", req["url"])
+        r.headers = CaseInsensitiveDict(rec.get("headers", []))
+        r.encoding = get_encoding_from_headers(r.headers) or "utf-8"
+        r.elapsed = datetime.timedelta(milliseconds=rec.get("elapsed_ms", 0))
+
+        if "body_b64" in rec:
+            r._content = base64.b64decode(rec["body_b64"])
+        else:
+            r._content = rec.get("body", "").encode("utf-8")
+
+        p = requests.PreparedRequest()
+        p.method = req["mode"]
+        p.url = req["url"]
+        p.headers = CaseInsensitiveDict(req["headers"])
+        p.body = req["body"] if isinstance(req["body"], bytes) else None
+        r.request = p
+
+        return r
+
+    def close(self):
+        with self._lock:
+            if self._fout:
+                self._fout.close()
+                self._fout = None
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+#
+# restest run deadline
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import time
+
+# the exit code of a run stopped by its deadline (the same as timeout(1))
+DEADLINE_EXIT_CODE = 124
+
+
+class DeadlineExceeded(SystemExit):
+    """
+    Raised when the run deadline has passed. Like sys.exit() it stops the run
+    (and it is not caught by the handlers of request errors), but the caller
+    of the run still closes the logs and saves the exports.
+    """
+
+    def __init__(self, seconds):
+        super().__init__(DEADLINE_EXIT_CODE)
+        self.seconds = seconds
+
+    def __str__(self):
+        return "deadline of %s s exceeded" % self.seconds
+
+
+class Deadline:
+    """
+    The time a run must end by: `seconds` after `start` (a time.time() value,
+    so that the worker processes of a run share the same deadline).
+
+    Requests and waits are cut at the deadline, and check() raises
+    DeadlineExceeded once it has passed.
+    """
+
+    def __init__(self, seconds, start=None):
+        self.seconds = seconds
+        self.end = (time.time() if start is None else start) + seconds
+
+    def remaining(self):
+        return self.end - time.time()
+
+    def cap(self, seconds):
+        # `seconds` (None means no limit), cut at the deadline
+        left = max(0.001, self.remaining())
+
+        return left if seconds is None else min(seconds, left)
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(self.seconds)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#
+# restest response document
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import json
+
+from .path_parser import ListIndex
+
+# bodies bigger than this are not pretty printed in error messages
+MAX_DUMP_SIZE = 64 * 1024
+
+
+class Document:
+    """
+    The JSON body of a response.
+
+    The body is decoded only the first time `data` is accessed, and then shared
+    by fields, tests and dumps of the same response, like the indexes of its
+    lists used by [key=value] lookups.
+    """
+
+    __slots__ = ("_resp", "_data", "_loaded", "_index")
+
+    def __init__(self, resp):
+        self._resp = resp
+        self._data = None
+        self._loaded = False
+        self._index = None
+
+    @property
+    def data(self):
+        if not self._loaded:
+            self._data = self._resp.json()
+            self._loaded = True
+
+        return self._data
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = ListIndex()
+
+        return self._index
+
+    def dump(self):
+        # the body as shown in error messages: pretty printed, unless it is too big
+        size = len(self._resp.content)
+        if size <= MAX_DUMP_SIZE:
+            return json.dumps(self.data, default=str, indent=2)
+
+        return "%s ... (%s bytes)" % (self._resp.text[:MAX_DUMP_SIZE], size)
+
+
+def document(resp):
+    # returns the Document of a response, creating it the first time
+    doc = getattr(resp, "doc", None)
+    if doc is None:
+        doc = Document(resp)
+        resp.doc = doc
+
+    return doc
@@ -5,16 +5,41 @@
 # written by Fabio Rotondo (fabio.rotondo@gmail.com)
 #
 
+import collections
 import copy
 import json
+import socket
 import sys
+import threading
 import time
 import urllib
 
 import requests
 
+from .document import document
 from .path_parser import expand_value
+from .template import DataTemplate, compile_template
+from .assertions import compile_assertion
 from .cols import xcolored as _c
+from .log_sink import open_sink, close_sinks
+from .multipart import MultipartEncoder
+from .profiler import NullProfiler
+from .http_cache import CacheStats, HTTPCache
+from .pool import ConnectionStats, PoolAdapter, no_cookies_session
+from .ratelimit import RateLimiter, RateStats
+from .retry import CircuitBreaker, RetryPolicy, RetryStats
+from .results import Results
+from .utils import str2size
+
+
+def _abort(r):
+    # stops the reading of a (streamed) response, by shutting its socket down
+    sock = getattr(getattr(r.raw, "connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
 
 class RESTest:
@@ -33,6 +58,9 @@ class RESTest:
         prefix="",
         auth_mode="auth",
         log_clean=False,  # 2.2.0 - Added log_clean
+        log_max_size=0,  # 2.4.0 - Added log rotation
+        log_gzip=False,  # 2.4.0 - Added log rotation
+        results=None,  # 2.4.0 - Added result sinks
     ):
         if not headers:
             headers = {}
@@ -48,6 +76,22 @@ class RESTest:
         self.prefix = prefix
         self.auth_mode = auth_mode
 
+        # 2.4.0 - log rotation (these can also be set in the 'system' section)
+        self.log_max_size = log_max_size
+        self.log_backups = 5
+        self.log_gzip = log_gzip
+        self._log_sink = None
+
+        # 2.4.0 - every request and test result is streamed to these sinks
+        self.results = results or Results()
+        self._title = ""
+
+        # 2.4.0 - per-phase timings of every request (see --profile)
+        self.profiler = NullProfiler()
+
+        # 2.4.0 - responses recorded to (or replayed from) a cassette
+        self.cassette = None
+
         self.globals = {}  # Global var / values for requests
 
         self.authorization_header = "Authorization"
@@ -70,6 +114,59 @@ class RESTest:
 
         self.session = requests.Session()
 
+        # 2.4.0 - connection pool settings (these can also be set in the 'system' section)
+        self.pool_connections = 10  # number of hosts kept in the pool
+        self.pool_maxsize = None  # connections per host
+        self.keep_alive = True
+
+        # 2.4.0 - GET responses cache: true, or { "ttl": 60, "max_entries": 256 }
+        #         (can also be set in the 'system' section, or per action)
+        self.cache = None
+
+        # 2.4.0 - requests per second: 10, or { "rps": 10, "burst": 1, "hosts": {...} }
+        #         (can also be set in the 'system' section, and per section)
+        self.rate = None
+        self.rate_share = 1  # number of processes sharing the limits
+        self.rate_buckets = []  # buckets of the enclosing sections
+        self.rate_wait_ns = 0  # time waited by the last request
+
+        # 2.4.0 - retries: 3, or { "attempts": 3, "status": [502], ... }
+        #         (see RetryPolicy, can also be set in the 'system' section
+        #         or per action) and circuit breaker: true, or
+        #         { "failures": 5, "reset": 30 } (in the 'system' section)
+        self.retry = None
+        self.circuit_breaker = None
+        self.retries = 0  # retries of the last request
+        self.retry_ns = 0  # time spent retrying the last request
+
+        # 2.4.0 - request timeouts in seconds: 30, or { "connect": 3, "read": 30 }
+        #         (can also be set in the 'system' section, or per action),
+        #         stored as a (connect, read) tuple (None: no timeout)
+        self.timeout = None
+
+        # 2.4.0 - the run deadline (see Deadline): requests and waits are cut
+        #         at it, and the run stops when it has passed
+        self.deadline = None
+
+        # shared by all the forks: the connection pool, the cookie-less session,
+        # the HTTP cache, the rate limiter, the retry policy and the circuit
+        # breaker (created by _shared(), under the lock), with the settings
+        # every one of them was built from
+        self.conn_stats = ConnectionStats()
+        self.cache_stats = CacheStats()
+        self.rate_stats = RateStats()
+        self.retry_stats = RetryStats()
+        self._http = {
+            "adapter": None,
+            "no_cookies": None,
+            "cache": None,
+            "limiter": None,
+            "retry": None,
+            "breaker": None,
+            "keys": {},
+            "lock": threading.Lock(),
+        }
+
         # Base URL and Prefix
         if not self.prefix:
             self.prefix = ""
@@ -84,6 +181,55 @@ class RESTest:
         if self.log_file and log_clean:
             open(self.log_file, "w").close()
 
+    # 2.4.0 - support for parallel sections
+    def fork(self):
+        """
+        Returns a new engine to be used by a parallel worker.
+
+        The worker has its own HTTP session and test counters, and a copy-on-write
+        view of the globals: reads fall through to this engine, writes stay in the
+        worker until join() merges them back.
+        """
+        w = copy.copy(self)
+
+        w.session = requests.Session()
+        w.session.cookies.update(self.session.cookies)
+
+        w.globals = collections.ChainMap({}, self.globals)
+        w.headers = self.headers.copy()
+        w.cookies = self.cookies.copy()
+        w.sections = list(self.sections)
+        w.rate_buckets = list(self.rate_buckets)
+
+        w._tests = 0
+        w._errors = 0
+
+        w.profiler = self.profiler.new()
+
+        return w
+
+    def join(self, w):
+        self._tests += w._tests
+        self._errors += w._errors
+
+        self.globals.update(w.globals.maps[0])
+        self.profiler.merge(w.profiler)
+
+    def close(self):
+        self.session.close()
+
+        if self._http["no_cookies"]:
+            self._http["no_cookies"].close()
+        if self._http["adapter"]:
+            self._http["adapter"].close()
+
+        self.results.close()
+        close_sinks()
+        self._log_sink = None
+
+        if self.cassette:
+            self.cassette.close()
+
     def _tabs(self, indent=0):
         return "\t" * (len(self.sections) + indent)
 
@@ -100,8 +246,18 @@ class RESTest:
         if not self.log_file:
             return
 
-        fout = open(self.log_file, "a")
-        fout.write(txt)
+        # 2.4.0 - the log file is kept open and written by a background thread,
+        #         its sink is looked up again only when log_file changes
+        sink = self._log_sink
+        if sink is None or sink.fname != self.log_file:
+            sink = self._log_sink = open_sink(
+                self.log_file,
+                max_size=str2size(self.log_max_size),
+                backups=self.log_backups,
+                compress=self.log_gzip,
+            )
+
+        sink.write(txt)
 
     def _log_start(self, method, endpoint, data):
         self._tests += 1
@@ -215,36 +371,41 @@ Raw Response: %s
         return res
 
     def _expand_dict(self, dct):
+        # 2.4.0 - a new dict is returned, the original one is left untouched
+        res = {}
         for k, v in dct.items():
-            if isinstance(v, str) and v.find("%(") != -1:
+            if isinstance(v, str):
                 v = self._get_v(v)
             elif isinstance(v, dict):
                 v = self._expand_dict(v)
             elif isinstance(v, list):
                 v = self._expand_list(v)
 
-            dct[k] = v
+            res[k] = v
 
-        return dct
+        return res
 
     def _get_v(self, x):
         if isinstance(x, dict):
             return self._expand_dict(x)
 
-        n = str(x)
-        if n.find("%(") == -1:
+        n = x
+        if not isinstance(n, str):
+            n = str(x)
+            if n.find("%(") == -1:
+                return x
+
+        # 2.4.0 - templates are compiled once and static strings are left as they are
+        t = compile_template(n)
+        if t.static:
             return x
 
-        if n.find("__internal_") != -1:
-            n = n.replace("__internal_", "")
-            return n % self._internal_info
+        if t.internal:
+            return t.render(self._internal_info)
 
-        return n % self.globals
+        return t.render(self.globals)
 
     def _expand_var(self, v):
-        globs = copy.copy(self.globals)
-        globs["inner_count"] = self._inner_count
-
         try:
             if isinstance(v, list):
                 v = self._expand_list(v)
@@ -301,23 +462,6 @@ Raw Response: %s
             res.append(temp)
         return res
 
-    def _object_compare(self, v1, v2):
-        o1 = eval(v1)
-        o2 = eval(v2)
-
-        k1 = list(o1.keys())
-        k2 = list(o2.keys())
-        k1.sort()
-        k2.sort()
-        if k1 != k2:
-            return False
-
-        for k in k1:
-            if o1[k] != o2[k]:
-                return False
-
-        return True
-
     def _data_to_url(self, dct):
         elems = []
         for k, v in dct.items():
@@ -366,41 +510,82 @@ Raw Response: %s
         content="json",
         headers=None,
         cookies=None,
+        cache=None,
+        retry=None,
+        timeout=None,
+    ):
+        req = self._prepare(
+            mode,
+            endpoint,
+            data,
+            authenticated=authenticated,
+            no_cookies=no_cookies,
+            files=files,
+            content=content,
+            headers=headers,
+            cookies=cookies,
+        )
+
+        if req is None:
+            return None
+
+        req["cache"] = cache
+        req["retry"] = retry
+        req["timeout"] = timeout
+
+        t = self.profiler.start()
+        r = self._exchange(req)
+        # the time spent waiting for the rate limiter is not network time
+        self.profiler.stop("network", t + self.rate_wait_ns)
+
+        return self._finish(req, r, title, status_code, skip_error, max_exec_time)
+
+    # 2.4.0 - _req has been split in _prepare, _send and _finish,
+    #         so that other engines only need to provide their own _send
+    def _prepare(
+        self,
+        mode,
+        endpoint,
+        data,
+        authenticated=True,
+        no_cookies=False,
+        files=None,
+        content="json",
+        headers=None,
+        cookies=None,
     ):
+        prof = self.profiler
+
+        t = prof.start()
         endpoint = self._expand_data({"endpoint": endpoint})["endpoint"]
+        prof.stop("template", t)
 
+        t = prof.start()
         url = self._resolve_url(endpoint)
+        prof.stop("url", t)
+
+        t = prof.start()
         headers = self._mk_headers(authenticated=authenticated, local_headers=headers)
         cookies = self._mk_cookies(local_cookies=cookies)
 
-        if type(data) is list:
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+
+        # 2.4.0 - bodies compiled by DataTemplate only expand their dynamic parts
+        tmpl = data if isinstance(data, DataTemplate) else None
+        if tmpl is not None:
+            data = tmpl.render(self)
+        elif type(data) is list:
             data = self._expand_data_list(data)
         else:
             data = self._expand_data(data)
-
-        if no_cookies:
-            obj = requests
-        else:
-            obj = self.session
-
-            # set cookies
-            for k, v in cookies.items():
-                self.session.cookies.set(k, v)
-
-        if mode == "DELETE":
-            m = obj.delete
-        elif mode == "GET":
-            m = obj.get
-        elif mode == "PATCH":
-            m = obj.patch
-        elif mode == "PUT":
-            m = obj.put
-        else:
-            m = obj.post
+        prof.stop("template", t)
 
         if mode == "GET" and data:
+            t = prof.start()
             url_params = self._data_to_url(data)
             url += "?" + url_params if url.find("?") == -1 else "&" + url_params
+            prof.stop("url", t)
 
         files = self._reorder_files(files)
         if files:
@@ -410,31 +595,428 @@ Raw Response: %s
             self._log_start(mode, url, data)
             return None
 
+        t = prof.start()
         if content == "json":
             # v1.90 - changing the json = data to data = encoded
             # 		  to better support UTF-8 strings
 
             # r = m ( url, json = data, headers = headers, files = files )
-            data = json.dumps(data, ensure_ascii=False, default=str)
-            encoded = data.encode("utf-8")
+            if tmpl is not None and tmpl.static:
+                data, body = tmpl.encoded()
+            else:
+                data = json.dumps(data, ensure_ascii=False, default=str)
+                body = data.encode("utf-8")
             headers["Content-Type"] = "application/json; charset=utf-8"
-            r = m(url, data=encoded, headers=headers, files=files)
 
         elif content == "form":
+            # the body may be shared with the script: it is never changed in place
+            data = dict(data)
             for k, v in data.items():
                 if isinstance(v, (list, dict)):
                     data[k] = json.dumps(v)
 
-            r = m(url, data=data, headers=headers, files=files)
+            body = data
+
+            # 2.4.0 - uploads are streamed, instead of being loaded in memory
+            if files:
+                body = MultipartEncoder(data, files)
+                headers["Content-Type"] = body.content_type
+                headers["Content-Length"] = str(len(body))
+                files = None
+        prof.stop("body", t)
+
+        return {
+            "mode": mode,
+            "url": url,
+            "data": data,
+            "body": body,
+            "headers": headers,
+            "cookies": cookies,
+            "files": files,
+            "no_cookies": no_cookies,
+        }
+
+    def _shared(self, name, factory, key=None):
+        # 2.4.0 - returns the object shared by the forks, creating it once: the
+        #         first requests may be sent by concurrent workers (ie. in a
+        #         parallel section), that must not build one object each.
+        #         `key` are the settings the object is built from: it is built
+        #         again when they change (ie. in the 'system' of the next file)
+        http = self._http
+        obj = http[name]
+        if obj is None or http["keys"].get(name) != key:
+            with http["lock"]:
+                obj = http[name]
+                if obj is None or http["keys"].get(name) != key:
+                    old = obj
+                    obj = http[name] = factory()
+                    http["keys"][name] = key
+
+                    # the sessions mount the new pool at their next request
+                    if isinstance(old, PoolAdapter):
+                        old.close()
+
+        return obj
+
+    def _adapter(self):
+        # the pool is created at the first request, after the 'system' section is parsed
+        return self._shared(
+            "adapter",
+            lambda: PoolAdapter(
+                self.conn_stats,
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize or 100,
+            ),
+            (self.pool_connections, self.pool_maxsize),
+        )
+
+    def _session(self, no_cookies):
+        # 2.4.0 - cookie-less requests use their own session too (instead of
+        #         the requests module functions), to reuse connections
+        if no_cookies:
+            s = self._shared("no_cookies", no_cookies_session)
+        else:
+            s = self.session
+
+        adapter = self._adapter()
+        if s.adapters.get("https://") is not adapter:
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+
+        return s
 
+    def _send(self, req):
+        obj = self._session(req["no_cookies"])
+
+        if not req["no_cookies"]:
+            # set cookies
+            for k, v in req["cookies"].items():
+                self.session.cookies.set(k, v)
+
+        m = getattr(obj, self._http_method(req["mode"]))
+
+        r = m(
+            req["url"],
+            data=req["body"],
+            headers=req["headers"],
+            files=req["files"],
+            timeout=self._timeouts(req),
+            stream=self.deadline is not None,
+        )
+
+        if self.deadline is None:
+            return r
+
+        # 2.4.0 - the timeouts only limit every single read: a server sending
+        #         the body slowly is cut by closing the connection at the deadline
+        watchdog = threading.Timer(self.deadline.cap(None), _abort, (r,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            r.content
+        finally:
+            watchdog.cancel()
+
+        self.deadline.check()
+
+        return r
+
+    def _timeouts(self, req):
+        # 2.4.0 - returns the (connect, read) timeouts of the request, cut at the deadline
+        timeout = self.timeout if req["timeout"] is None else req["timeout"]
+        connect, read = timeout or (None, None)
+
+        if self.deadline:
+            return self.deadline.cap(connect), self.deadline.cap(read)
+
+        return connect, read
+
+    def _sleep(self, seconds):
+        self._drive(self._pause(seconds))
+
+    def _pause(self, seconds):
+        # 2.4.0 - waits are cut at the run deadline (see _flow)
+        if self.deadline:
+            seconds = self.deadline.cap(seconds)
+
+        yield ("sleep", seconds)
+
+        if self.deadline:
+            self.deadline.check()
+
+    def _drive(self, flow):
+        """
+        Runs a flow (see _flow): the sends and the sleeps it yields block
+        the calling thread. Returns the value returned by the flow.
+        """
+        value = error = None
+        while True:
+            try:
+                if error is None:
+                    op, arg = flow.send(value)
+                else:
+                    op, arg = flow.throw(error)
+            except StopIteration as e:
+                return e.value
+
+            value = error = None
+            if op == "sleep":
+                time.sleep(arg)
+                continue
+
+            try:
+                value = self._send(arg)
+            except Exception as e:
+                error = e
+
+    def _http_cache(self, req):
+        # returns the HTTP cache and the TTL to use for the request (if cached)
+        if req["mode"] != "GET":
+            return None, None
+
+        opts = self.cache if req["cache"] is None else req["cache"]
+        if not opts:
+            return None, None
+
+        system = self.cache if isinstance(self.cache, dict) else {}
+        cache = self._shared(
+            "cache",
+            lambda: HTTPCache(
+                self.cache_stats,
+                ttl=system.get("ttl", 60),
+                max_entries=system.get("max_entries", 256),
+            ),
+            (system.get("ttl"), system.get("max_entries")),
+        )
+
+        return cache, opts.get("ttl") if isinstance(opts, dict) else None
+
+    def _cache_cookies(self, req):
+        # 2.4.0 - the cookies sent with the request (the ones of the session
+        #         included), as part of the cache key: None for no_cookies requests
+        if req["no_cookies"]:
+            return None
+
+        cookies = set(self._jar_cookies())
+        cookies.update(("", k, str(v)) for k, v in req["cookies"].items())
+
+        return tuple(sorted(cookies))
+
+    def _jar_cookies(self):
+        # (domain, name, value) of the cookies in the session
+        return [(c.domain, c.name, c.value) for c in self.session.cookies]
+
+    def rate_limiter(self):
+        return self._shared(
+            "limiter",
+            lambda: RateLimiter(self.rate, self.rate_stats, self.rate_share),
+            self.rate,
+        )
+
+    def _rate_wait(self, req):
+        # 2.4.0 - returns the seconds to wait before sending the request
+        if not self.rate and not self.rate_buckets:
+            return 0
+
+        wait = self.rate_limiter().reserve(req["url"], self.rate_buckets)
+        ns = int(wait * 1000000000)
+        self.rate_wait_ns += ns
+        self.profiler.add("wait", ns)
+
+        return wait
+
+    def _retry_policy(self, req):
+        # 2.4.0 - returns the retry policy of the request (None for no retries)
+        policy = req["retry"]
+        if policy is None:
+            if not self.retry:
+                return None
+
+            policy = self._shared("retry", lambda: RetryPolicy(self.retry), self.retry)
+
+        if not policy:
+            return None
+
+        if not isinstance(policy, RetryPolicy):
+            policy = RetryPolicy(policy)
+
+        return policy if policy.allows(req["mode"]) else None
+
+    def _breaker(self):
+        if not self.circuit_breaker:
+            return None
+
+        opts = self.circuit_breaker
+        if not isinstance(opts, dict):
+            opts = {}
+
+        return self._shared(
+            "breaker",
+            lambda: CircuitBreaker(
+                self.retry_stats, opts.get("failures", 5), opts.get("reset", 30)
+            ),
+            opts,
+        )
+
+    def _retry_delay(self, policy, breaker, host, attempt, r=None, e=None):
+        # 2.4.0 - called after every attempt: updates the circuit breaker and
+        #         returns the seconds to wait before retrying (None: no retry)
+        if breaker:
+            if e is None and r.status_code < 500:
+                breaker.success(host)
+            elif breaker.failure(host):
+                return None
+
+        if policy is None or attempt >= policy.attempts:
+            return None
+
+        if e is not None:
+            return policy.delay(attempt) if policy.retry_exception(e) else None
+
+        return policy.delay(attempt, r) if policy.retry_status(r.status_code) else None
+
+    def _retried(self, attempt, start, t):
+        # 2.4.0 - `start` is when the first attempt began, `t` when the last one did
+        if attempt == 1:
+            return
+
+        self.retries = attempt - 1
+        self.retry_ns = t - start - self.rate_wait_ns
+        self.retry_stats.add(retries=self.retries, requests=1, retry_ns=self.retry_ns)
+
+    def _send_retry(self, req):
+        # 2.4.0 - sends the request (see _flow), retrying it as set by its retry policy
+        policy = self._retry_policy(req)
+        breaker = self._breaker()
+        host = CircuitBreaker.host(req["url"]) if breaker else None
+
+        if breaker:
+            breaker.check(host)
+
+        start = time.perf_counter_ns()
+        attempt = 0
+        while True:
+            attempt += 1
+
+            wait = self._rate_wait(req)
+            if wait:
+                yield from self._pause(wait)
+
+            t = time.perf_counter_ns()
+            try:
+                r = yield ("send", req)
+            except Exception as e:
+                # a request cut by the run deadline stops the run
+                if self.deadline:
+                    self.deadline.check()
+
+                delay = self._retry_delay(policy, breaker, host, attempt, e=e)
+                if delay is None:
+                    self._retried(attempt, start, t)
+                    raise
+            else:
+                delay = self._retry_delay(policy, breaker, host, attempt, r=r)
+                if delay is None:
+                    self._retried(attempt, start, t)
+                    return r
+
+            yield from self._pause(delay)
+
+    def _exchange(self, req):
+        return self._drive(self._flow(req))
+
+    def _flow(self, req):
+        """
+        The exchange of a request, shared by all the engines: the HTTP cache,
+        the cassette, the rate limiter, the retry policy and the circuit breaker.
+
+        It is a generator yielding what it has to wait for: ("send", req) gets
+        back the response (or has the exception thrown in), ("sleep", seconds)
+        nothing. Engines only provide a driver running the sends and the sleeps:
+        _drive() here, AsyncRESTest._adrive() on the event loop.
+        """
+        self.rate_wait_ns = 0
+        self.retries = 0
+        self.retry_ns = 0
+
+        # 2.4.0 - no request is sent after the run deadline
+        if self.deadline:
+            self.deadline.check()
+
+        # 2.4.0 - GET responses can be served by the HTTP cache
+        cache, ttl = self._http_cache(req)
+        if cache:
+            r = cache.lookup(req, ttl, self._cache_cookies(req))
+            if r is not None:
+                return r
+
+        # 2.4.0 - responses can be replayed from a cassette, instead of the network
+        replayed = self.cassette and self.cassette.replaying
+        if replayed:
+            r = self.cassette.replay(req)
+        else:
+            # 2.4.0 - requests sent to the network go through the rate limiter,
+            #         the retry policy and the circuit breaker
+            r = yield from self._send_retry(req)
+
+        if cache:
+            r = cache.store(req, r)
+
+        # the response recorded is the one used: the cached one when a
+        # conditional request is answered with 304 (that has no body)
+        if self.cassette and not replayed:
+            self.cassette.record(req, r)
+
+        return r
+
+    def _http_method(self, mode):
+        if mode in ("DELETE", "GET", "PATCH", "PUT"):
+            return mode.lower()
+
+        return "post"
+
+    def _finish(self, req, r, title, status_code, skip_error, max_exec_time):
+        mode = req["mode"]
+        url = req["url"]
+        data = req["data"]
+        headers = req["headers"]
+
+        prof = self.profiler
+
+        t = prof.start()
         self._parse_headers(r)
+        prof.stop("headers", t)
 
+        t = prof.start()
         if self.postman:
             self.postman.add(title, mode, url, data, headers, r)
 
         self._log_start(mode, url, data)
         self._log_resp(headers, r)
+        prof.stop("log", t)
+
+        t = prof.start()
         self._log_curl(r.request)
+        prof.stop("curl", t)
+
+        t = prof.start()
+        self._title = title
+        if self.results:
+            ok = skip_error or r.status_code == status_code
+            err = "Status: %s (expected: %s)" % (r.status_code, status_code)
+            self.results.request(
+                self._section(),
+                title,
+                mode,
+                url,
+                r.status_code,
+                status_code,
+                r.elapsed.total_seconds() * 1000,
+                len(r.content),
+                ok,
+                None if ok else err,
+            )
+        prof.stop("log", t)
 
         # If skip_error is set, we don't have to check for the status code
         if skip_error:
@@ -479,12 +1061,15 @@ Raw Response: %s
         headers=None,
         cookies=None,
         internal_info=None,
+        cache=None,
+        retry=None,
+        timeout=None,
     ):
         # v2.0 - added internal_info dict to the Engine class
         self._internal_info = internal_info
 
         if self.delay:
-            time.sleep(self.delay // 1000)
+            self._sleep(self.delay / 1000)
 
         return self._req(
             meth,
@@ -500,10 +1085,14 @@ Raw Response: %s
             content=content,
             headers=headers,
             cookies=cookies,
+            cache=cache,
+            retry=retry,
+            timeout=timeout,
         )
 
     def fields(self, resp, fields):
-        j = resp.json()
+        # 2.4.0 - the response body is decoded once, when first needed
+        doc = document(resp)
 
         for k in fields:
             if isinstance(k, (list, tuple)):
@@ -519,13 +1108,13 @@ Raw Response: %s
 
             # ADD: support for '*' field name (all JSON)
             if json_key == "*":
-                self.globals[glob_key] = j
+                self.globals[glob_key] = doc.data
                 continue
 
-            self.globals[glob_key] = self._expand_value(j, json_key)
+            self.globals[glob_key] = self._expand_value(doc.data, json_key, doc.index)
 
     def dumps(self, resp, fields):
-        j = resp.json()
+        doc = document(resp)
 
         for k in fields:
             if isinstance(k, (list, tuple)):
@@ -538,7 +1127,7 @@ Raw Response: %s
                 glob_key = k
                 json_key = k
 
-            v = self._expand_value(j, json_key)
+            v = self._expand_value(doc.data, json_key, doc.index)
 
             print("==== %s: %s\n" % (glob_key, json.dumps(v, indent=4, default=str)))
 
@@ -550,10 +1139,10 @@ Raw Response: %s
         self._errors += 1
         return None
 
-    def _expand_value(self, dct, key):
+    def _expand_value(self, dct, key, index=None):
         key = self._expand_var(key)
 
-        res, err = expand_value(key, dct)
+        res, err = expand_value(key, dct, index)
 
         if err:
             print("PATH: %s - Error: %s" % (key, err))
@@ -575,104 +1164,19 @@ Raw Response: %s
 
     def sleep(self, _ms):
         _ms = self._expand_var(_ms)
-        time.sleep(int(_ms) / 1000)
+        self._sleep(int(_ms) / 1000)
 
     def _check(self, chk, field, v):
-        current_val = self._expand_var(v)
-        expected_val = self._expand_var(chk.get("value"))
-
-        mode = chk.get("mode", "EQUALS")
-
-        cols = (
-            _c(self, field, "white"),
-            _c(self, expected_val, "yellow"),
-            _c(self, current_val, "red"),
-        )
-
-        # mode is now case insensitive
-        mode = mode.upper()
-
-        if mode in ("EXISTS", "EXIST", "!!", "NOT_NULL", "IS_NOT_NULL"):
-            if (str(v) == "None") or (len(str(v)) == 0):
-                return "FIELD: %s is EMPTY" % (_c(self, field, "white"))
-        elif mode in (
-            "EMPTY",
-            "IS_EMPTY",
-            "IS_NULL",
-            "NULL",
-            "NOT_EXISTS",
-            "NOT_EXIST",
-            "@",
-        ):
-            if str(v) != "None":
-                return "FIELD: %s VALUE mismatch. Expected: Null - got: %s" % (
-                    _c(self, field, "white"),
-                    _c(self, current_val, "red"),
-                )
-        elif mode in ("EQUALS", "==", "=", "EQUAL"):
-            if (current_val != expected_val) and (
-                str(current_val) != str(expected_val)
-            ):
-                return "FIELD: %s VALUE mismatch. Expected: %s - got: %s" % cols
-        elif mode in ("NOT_EQUAL", "!=", "<>"):
-            if current_val == expected_val:
-                return (
-                    "FIELD: %s VALUE mismatch. Expected difference: %s - got: %s" % cols
-                )
-        elif mode in ("CONTAINS", "->"):
-            if expected_val not in current_val:
-                return "FIELD: %s DOES NOT contains %s. List: %s" % cols
-        elif mode in ("SIZE", "LEN", "LENGTH"):
-            if len(current_val) != int(expected_val):
-                return "FIELD: %s SIZE mismatch. Expected: %s - got: %s (%s)" % (
-                    _c(self, field, "white"),
-                    _c(self, expected_val, "yellow"),
-                    _c(self, len(current_val), "red"),
-                    _c(self, current_val, "yellow"),
-                )
-        elif mode in ("GT", ">"):
-            if isinstance(current_val, str):
-                current_val = int(current_val)
-            if current_val <= expected_val:
-                return "FIELD: %s is SMALLER. Expected: %s got: %s" % cols
-        elif mode in ("GTE", ">="):
-            if isinstance(current_val, str):
-                current_val = int(current_val)
-            if current_val < expected_val:
-                return "FIELD: %s is SMALLER. Expected: %s got: %s" % cols
-        elif mode in ("LT", "<"):
-            if isinstance(current_val, str):
-                current_val = int(current_val)
-            if current_val >= expected_val:
-                return "FIELD: %s is BIGGER. Expected: %s got: %s" % cols
-        elif mode in ("LTE", "<="):
-            if isinstance(current_val, str):
-                current_val = int(current_val)
-            if current_val <= expected_val:
-                return "FIELD: %s is BIGGER. Expected: %s got: %s" % cols
-        elif mode in ("SIZE-GT", "()>"):
-            if len(current_val) <= int(expected_val):
-                return "FIELD: %s is SMALLER. Expected: %s got: %s" % cols
-        elif mode in ("SIZE-GTE", "()>="):
-            if len(current_val) < int(expected_val):
-                return "FIELD: %s is SMALLER. Expected: %s got: %s" % cols
-        elif mode in ("SIZE-LT", "()<"):
-            if len(current_val) >= int(expected_val):
-                return "FIELD: %s is BIGGER. Expected: %s got: %s" % cols
-        elif mode in ("SIZE-LTE", "()<="):
-            if len(current_val) <= int(expected_val):
-                return "FIELD: %s is BIGGER. Expected: %s got: %s" % cols
-        elif mode in ("OBJ", "OBJECT"):
-            if not self._object_compare(current_val, expected_val):
-                return "FIELD: %s object values mismatch" % (_c(self, field, "white"))
-        else:
-            return "ERROR: unsupported test mode: %s " % mode
+        # 2.4.0 - tests are compiled once in lib/assertions.py
+        err = compile_assertion(chk).run(self, field, v)
+        if err:
+            return err
 
         if "save" in chk:
             self.globals[chk["save"]] = v
 
     def check(self, resp, checks):
-        j = resp.json()
+        doc = document(resp)
 
         for chk in checks:
             if "title" in chk:
@@ -689,19 +1193,37 @@ Raw Response: %s
             if field == "rt:size":
                 v = str(resp.size)
             else:
-                v = self._expand_value(j, field)
+                v = self._expand_value(doc.data, field, doc.index)
 
             err = self._check(chk, field, v)
 
+            if self.results:
+                self._test_result(chk, field, v, err)
+
             if v == "__NOT_FOUND__":
-                return self._error(
-                    "FIELD: %s missing %s"
-                    % (field, json.dumps(j, default=str, indent=2))
-                )
+                return self._error("FIELD: %s missing %s" % (field, doc.dump()))
 
             if err:
                 return self._error(err)
 
+    def _test_result(self, chk, field, v, err):
+        if v == "__NOT_FOUND__":
+            err = "FIELD: %s missing" % field
+
+        self.results.test(
+            self._section(),
+            chk.get("title", self._title),
+            field,
+            chk.get("mode", "EQUALS").upper(),
+            chk.get("value"),
+            None if v == "__NOT_FOUND__" else v,
+            not err,
+            err,
+        )
+
+    def _section(self):
+        return " / ".join(self.sections)
+
     def dump(self, fields, do_print=False):
         for f in fields:
             f = self._expand_var(f)
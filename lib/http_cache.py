@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# restest HTTP cache
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import collections
+import copy
+import threading
+import time
+
+# request headers that change the response (they are part of the cache key)
+VARY_HEADERS = ("authorization", "accept", "accept-language")
+
+# Cache-Control directives of responses that must not be cached
+NO_CACHE = ("no-store", "no-cache", "private", "max-age=0")
+
+
+class CacheStats:
+    """
+    Counts the GET requests answered by the cache (hits), the ones sent to
+    the server (misses) and the conditional ones answered with a 304 (revalidated).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.hits or self.misses)
+
+    def add(self, hits=0, misses=0, revalidated=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.revalidated += revalidated
+
+    def summary(self):
+        return "%s hits - %s misses - %s revalidated (304)" % (
+            self.hits,
+            self.misses,
+            self.revalidated,
+        )
+
+
+class _Entry:
+    __slots__ = ("resp", "expires", "etag", "last_modified")
+
+    def __init__(self, resp, ttl):
+        self.resp = resp
+        self.expires = time.monotonic() + ttl
+        self.etag = resp.headers.get("ETag")
+        self.last_modified = resp.headers.get("Last-Modified")
+
+
+class HTTPCache:
+    """
+    An in memory cache of GET responses, keyed by the resolved URL, the
+    headers in VARY_HEADERS and the cookies sent with the request (the ones
+    of the session included).
+
+    Responses are served from the cache for `ttl` seconds. When they expire,
+    and the server sent an ETag (or a Last-Modified) header, the next request
+    is sent with If-None-Match (or If-Modified-Since): on 304 the cached
+    response is served again, for another `ttl` seconds.
+    The oldest responses are evicted when there are more than `max_entries`.
+
+    The cache is shared by all the workers of a run.
+    """
+
+    def __init__(self, stats, ttl=60, max_entries=256):
+        self.stats = stats
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, req, cookies):
+        headers = {k.lower(): v for k, v in req["headers"].items()}
+
+        return (
+            req["url"],
+            tuple(headers.get(h) for h in VARY_HEADERS),
+            cookies,
+        )
+
+    def lookup(self, req, ttl=None, cookies=None):
+        """
+        Returns the cached response for the request, if still valid.
+        `cookies` are the cookies sent with the request, as a hashable value
+        (None for no_cookies requests).
+
+        Otherwise the request is prepared for store(): if the cached response
+        can be revalidated, the conditional headers are added to the request.
+        """
+        key = self._key(req, cookies)
+        req["cache_key"] = key
+        req["cache_ttl"] = self.ttl if ttl is None else ttl
+
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None:
+                self._entries.move_to_end(key)
+
+        if e is not None and e.expires > time.monotonic():
+            self.stats.add(hits=1)
+            return self._copy(e.resp)
+
+        self.stats.add(misses=1)
+
+        req["cache_entry"] = None
+        if e is not None and (e.etag or e.last_modified):
+            req["cache_entry"] = e
+            req["headers"] = dict(req["headers"])
+            if e.etag:
+                req["headers"]["If-None-Match"] = e.etag
+            if e.last_modified:
+                req["headers"]["If-Modified-Since"] = e.last_modified
+
+        return None
+
+    def store(self, req, r):
+        """
+        Stores the response of a request prepared by lookup(), and returns the
+        response to use: the cached one, if the server answered 304.
+        """
+        e = req.get("cache_entry")
+        ttl = req["cache_ttl"]
+
+        if e is not None and r.status_code == 304:
+            self.stats.add(revalidated=1)
+            e.expires = time.monotonic() + ttl
+
+            cached = self._copy(e.resp)
+            cached.elapsed = r.elapsed
+            return cached
+
+        if r.status_code != 200 or not _cacheable(r):
+            return r
+
+        with self._lock:
+            self._entries[req["cache_key"]] = _Entry(r, ttl)
+            self._entries.move_to_end(req["cache_key"])
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return self._copy(r)
+
+    def _copy(self, resp):
+        # every request gets its own response object (the body is shared)
+        r = copy.copy(resp)
+        r.__dict__.pop("doc", None)
+
+        return r
+
+
+def _cacheable(r):
+    for d in r.headers.get("Cache-Control", "").lower().split(","):
+        if d.replace(" ", "") in NO_CACHE:
+            return False
+
+    return True
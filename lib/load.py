@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# restest load runner
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .cols import xcolored
+from .timings import Histogram
+
+
+class LoadRunner:
+    """
+    Runs an action as a load generator.
+
+    The action keys used are:
+
+        - concurrency: number of requests in flight at the same time (default: 1)
+        - rps:         target requests per second for the whole action (default: no limit)
+        - duration:    run time in seconds (default: until `repeat` requests are done)
+        - repeat:      total number of requests (default: 1, or no limit if `duration` is set)
+
+    Every concurrent worker is a fork of the parser, so it has its own engine
+    and globals view; counters and timings are merged back at the end.
+    """
+
+    def __init__(self, parser, act):
+        self.parser = parser
+        self.act = act
+        # the action is compiled once, for all the workers
+        self.args = parser._exec_args(act)
+
+        self.concurrency = max(1, int(act.get("concurrency", 1)))
+        self.rps = float(act.get("rps", 0))
+        self.duration = float(act.get("duration", 0))
+
+        if "repeat" in act or not self.duration:
+            self.total = int(act.get("repeat", 1))
+        else:
+            self.total = None
+
+        self.status_code = act.get("status_code", act.get("status", 200))
+
+        self._lock = threading.Lock()
+        self._count = 0
+        self._start = 0
+        self._end = None
+        self._exit = None
+
+        self.latencies = Histogram()
+        self.errors = 0
+        self.failed = 0
+
+    def _next(self):
+        # returns the index of the next request to send, or None when done
+        with self._lock:
+            if self._exit is not None:
+                return None
+
+            if self.total is not None and self._count >= self.total:
+                return None
+
+            if self._end is not None and time.perf_counter() >= self._end:
+                return None
+
+            i = self._count
+            self._count += 1
+
+        return i
+
+    def _delay(self, i):
+        # how long to wait for request i to keep the target rate
+        if not self.rps:
+            return 0
+
+        return self._start + i / self.rps - time.perf_counter()
+
+    def _record(self, w, res, elapsed, errors):
+        failed = res is None or res.status_code != self.status_code
+
+        with self._lock:
+            self.latencies.add(elapsed * 1000000)
+            # request errors (res is None) are already counted by the worker
+            if res is not None and failed:
+                self.failed += 1
+            if failed or w.rt._errors != errors:
+                self.errors += 1
+
+    def _worker(self, w):
+        while True:
+            i = self._next()
+            if i is None:
+                return
+
+            errors = w.rt._errors
+            try:
+                delay = self._delay(i)
+                if delay > 0:
+                    w.rt._sleep(delay)
+
+                t = time.perf_counter()
+                res = w._send_req(self.act, i, self.args)
+            except SystemExit as e:
+                # 2.4.0 - sys.exit() (ie. at the run deadline) stops the other
+                #         workers too: all of them are merged before it is raised again
+                self._exit = e
+                return
+            elapsed = time.perf_counter() - t - w.rt.rate_wait_ns / 1000000000
+
+            w._post_process(self.act, res)
+
+            self._record(w, res, elapsed, errors)
+
+    async def _aworker(self, w):
+        while True:
+            i = self._next()
+            if i is None:
+                return
+
+            errors = w.rt._errors
+            act = self.act
+            args = self.args
+
+            try:
+                delay = self._delay(i)
+                if delay > 0:
+                    await w.rt._asleep(delay)
+
+                t = time.perf_counter()
+                w.rt.profiler.begin("%s %s" % (args["meth"], act["url"]))
+                w.timings.start(
+                    args["meth"], act["url"], args["data"].source, w.rt.profiler.current
+                )
+                res = await w.rt.do_EXEC_async(internal_info={"counter": i + 1}, **args)
+                w.timings.end(
+                    res.status_code, w.rt.rate_wait_ns, w.rt.retries, w.rt.retry_ns
+                )
+                res.size = len(res.content)
+            except SystemExit as e:
+                # sys.exit() must not be raised inside the event loop,
+                # it is raised again by run() in the calling thread
+                self._exit = e
+                return
+            except Exception as e:
+                res = None
+                w.rt._error(
+                    "REQUEST: %s %s - %s"
+                    % (args["meth"], act["url"], str(e) or type(e).__name__)
+                )
+            elapsed = time.perf_counter() - t - w.rt.rate_wait_ns / 1000000000
+
+            w._post_process(act, res)
+
+            self._record(w, res, elapsed, errors)
+
+    async def _arun(self, workers):
+        await asyncio.gather(*[self._aworker(w) for w in workers])
+
+    def run(self):
+        p = self.parser
+
+        workers = [p.fork() for _ in range(self.concurrency)]
+        for w in workers:
+            w.quiet = True
+            w.rt.quiet = True
+            w.rt.stop_on_error = False
+
+        self._start = time.perf_counter()
+        if self.duration:
+            self._end = self._start + self.duration
+
+        if hasattr(p.rt, "do_EXEC_async"):
+            p.rt.run(self._arun(workers))
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for f in [pool.submit(self._worker, w) for w in workers]:
+                    f.result()
+
+        elapsed = time.perf_counter() - self._start
+
+        for w in workers:
+            p.join(w)
+
+        # failed tests and request errors are already counted by the workers,
+        # unexpected status codes are not
+        p.rt._errors += self.failed
+
+        if self._exit is not None:
+            raise self._exit
+
+        self.report(elapsed)
+
+        return True
+
+    def report(self, elapsed):
+        p = self.parser
+        act = self.act
+
+        lats = self.latencies
+        count = lats.count
+
+        txt = (
+            "LOAD: %s %s - requests: %s - errors: %s - time: %.3f s - %.2f req/s\n"
+            "      latency (ms) - p50: %.2f - p90: %.2f - p99: %.2f - max: %.2f\n"
+            % (
+                act["method"].upper(),
+                act["url"],
+                count,
+                self.errors,
+                elapsed,
+                count / elapsed if elapsed else 0,
+                lats.percentile(50) / 1000,
+                lats.percentile(90) / 1000,
+                lats.percentile(99) / 1000,
+                lats.max / 1000,
+            )
+        )
+
+        p.rt._log_write("\n%s\n" % txt)
+
+        if not p.quiet:
+            col = "red" if self.errors else "green"
+            p._out("%s %s\n" % (p.rt._tabs(), xcolored(p, txt, col)))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+# restest log sink
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import atexit
+import gzip
+import os
+import shutil
+import threading
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+class LogSink:
+    """
+    A log file kept open for the whole run.
+
+    write() only appends the text to an in-memory buffer: a background thread
+    writes the buffer to disk every `flush_interval` seconds (or as soon as it
+    grows over `max_buffer` bytes). When `max_size` is set, the file is rotated
+    as soon as it gets bigger than that, keeping `backups` old files
+    (name.1, name.2, ...), optionally gzipped.
+    """
+
+    def __init__(
+        self,
+        fname,
+        max_size=0,
+        backups=5,
+        compress=False,
+        flush_interval=0.5,
+        max_buffer=1024 * 1024,
+    ):
+        self.fname = fname
+        self.max_size = max_size
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._buf = []
+        self._buf_size = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        # the file is written in bytes, so that its size is counted in bytes too
+        self._fout = open(fname, "ab")
+        self._size = self._fout.tell()
+
+        self._thread = threading.Thread(
+            target=self._run, name="restest-log", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, txt):
+        with self._lock:
+            self._buf.append(txt)
+            self._buf_size += len(txt)
+
+            if self._buf_size >= self.max_buffer:
+                self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self):
+        with self._lock:
+            buf = self._buf
+            self._buf = []
+            self._buf_size = 0
+
+        if not buf:
+            return
+
+        data = "".join(buf).encode("utf-8")
+        self._fout.write(data)
+        self._fout.flush()
+        self._size += len(data)
+
+        if self.max_size and self._size >= self.max_size:
+            self._rotate()
+
+    def _backup_name(self, n):
+        name = "%s.%s" % (self.fname, n)
+        if self.compress:
+            name += ".gz"
+        return name
+
+    def _rotate(self):
+        self._fout.close()
+
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._backup_name(n)):
+                os.replace(self._backup_name(n), self._backup_name(n + 1))
+
+        if self.backups:
+            if self.compress:
+                with open(self.fname, "rb") as fin:
+                    with gzip.open(self._backup_name(1), "wb") as fout:
+                        shutil.copyfileobj(fin, fout)
+                os.remove(self.fname)
+            else:
+                os.replace(self.fname, self._backup_name(1))
+
+        self._fout = open(self.fname, "wb")
+        self._size = 0
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+
+        self._drain()
+        self._fout.close()
+
+
+def open_sink(fname, **kwargs):
+    # every engine (and every parallel worker) writing to the same file shares one sink
+    with _sinks_lock:
+        sink = _sinks.get(fname)
+        if sink is None:
+            sink = LogSink(fname, **kwargs)
+            _sinks[fname] = sink
+
+    return sink
+
+
+def close_sinks():
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+
+    for sink in sinks:
+        sink.close()
+
+
+atexit.register(close_sinks)
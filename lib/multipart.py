@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# restest streaming multipart encoder
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import mimetypes
+import mmap
+import os
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+# the block repeated to build generated payloads
+_PATTERN = bytes(range(256))
+
+
+class FilePart:
+    """
+    A file to upload. The file is opened only while it is being sent, and
+    read in chunks (from a memory map, when the file can be mapped).
+    """
+
+    def __init__(self, fname, filename=None):
+        self.fname = fname
+        self.filename = filename or os.path.basename(fname)
+        self.size = os.path.getsize(fname)
+        self.content_type = (
+            mimetypes.guess_type(self.filename)[0] or "application/octet-stream"
+        )
+
+    def chunks(self, size):
+        with open(self.fname, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # empty files (and special files) can not be mapped
+                mm = None
+
+            if mm is None:
+                yield from iter(lambda: f.read(size), b"")
+                return
+
+            with mm:
+                for pos in range(0, len(mm), size):
+                    yield mm[pos : pos + size]
+
+
+class GeneratedPart:
+    """
+    A payload of `size` bytes generated on the fly, for upload benchmarks.
+    """
+
+    def __init__(self, size, filename="payload.bin"):
+        self.size = size
+        self.filename = filename
+        self.content_type = "application/octet-stream"
+
+    def chunks(self, size):
+        block = (_PATTERN * (size // len(_PATTERN) + 1))[:size]
+
+        left = self.size
+        while left > 0:
+            n = min(size, left)
+            yield block if n == size else block[:n]
+            left -= n
+
+
+class MultipartEncoder:
+    """
+    A multipart/form-data body streamed in chunks.
+
+    `fields` is a dict of form fields, `files` a dict (or a list of
+    (name, part) tuples) of FilePart / GeneratedPart objects.
+    The body length is known in advance, so it is sent with a Content-Length
+    header instead of a chunked transfer encoding. The body can be iterated
+    more than once (eg. on redirects): files are opened again every time.
+    """
+
+    def __init__(self, fields, files, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+
+        self._parts = []
+
+        for k, v in fields.items():
+            head = 'Content-Disposition: form-data; name="%s"\r\n\r\n' % k
+            self._parts.append((self._head(head), str(v).encode("utf-8")))
+
+        if isinstance(files, dict):
+            files = files.items()
+
+        for k, part in files:
+            head = (
+                'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                "Content-Type: %s\r\n\r\n" % (k, part.filename, part.content_type)
+            )
+            self._parts.append((self._head(head), part))
+
+        self._tail = ("--%s--\r\n" % self.boundary).encode("utf-8")
+
+        self.length = len(self._tail)
+        for head, body in self._parts:
+            self.length += len(head) + self._size(body) + 2
+
+    def _head(self, txt):
+        return ("--%s\r\n%s" % (self.boundary, txt)).encode("utf-8")
+
+    def _size(self, body):
+        if isinstance(body, bytes):
+            return len(body)
+
+        return body.size
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for head, body in self._parts:
+            yield head
+
+            if isinstance(body, bytes):
+                yield body
+            else:
+                yield from body.chunks(CHUNK_SIZE)
+
+            yield b"\r\n"
+
+        yield self._tail
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
@@ -10,11 +10,26 @@ import json
 import os
 import gzip
 import bz2
+import copy
+import csv
+import collections
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 from .engine import RESTest
+from .assertions import load_plugin
+from .cassette import Cassette, CassetteError
 from .cols import xcolored
+from .deadline import DeadlineExceeded
 from .timings import Timings
-from .utils import deepcopy, size2str
+from .load import LoadRunner
+from .multipart import FilePart, GeneratedPart
+from .profiler import Profiler
+from .results import Results, open_result_sink
+from .retry import RetryPolicy
+from .script import Action, ScriptCompiler, ScriptError, default_cache_dir
+from .template import DataTemplate
+from .utils import size2str, str2size
 
 
 class RESTestParser:
@@ -33,8 +48,31 @@ class RESTestParser:
         auth_mode="auth",
         log_clean=False,  # 2.2.0 - support for log_clean
         debug_file_name=None,  # 2.4.0 - support for debug_file_name
+        jobs=4,  # 2.4.0 - support for parallel sections
+        engine="sync",  # 2.4.0 - support for the async engine
+        log_max_size=0,  # 2.4.0 - support for log rotation
+        log_gzip=False,  # 2.4.0 - support for log rotation
+        cache_dir=None,  # 2.4.0 - support for compiled scripts cache ("" to disable)
+        timings="full",  # 2.4.0 - support for aggregate timings
+        timings_params=True,  # 2.4.0 - support for aggregate timings
+        results=None,  # 2.4.0 - support for result sinks (list of file names)
+        pool=None,  # 2.4.0 - connection pool settings overriding the 'system' ones
+        profile=False,  # 2.4.0 - support for per-phase profiling
+        record=None,  # 2.4.0 - support for cassettes (file name)
+        replay=None,  # 2.4.0 - support for cassettes (file name)
+        rate=None,  # 2.4.0 - support for rate limits (requests per second)
+        rate_share=1,  # 2.4.0 - support for rate limits (number of processes)
+        deadline=None,  # 2.4.0 - support for the run deadline (a Deadline)
     ):
-        self.rt = RESTest(
+        # 2.4.0 - aiohttp is imported only when the async engine is used
+        if engine == "async":
+            from .async_engine import AsyncRESTest as engine_class
+        else:
+            engine_class = RESTest
+
+        self.no_colors = no_colors
+
+        self.rt = engine_class(
             quiet=quiet,
             log_file=log_file,
             postman=postman,
@@ -45,16 +83,29 @@ class RESTestParser:
             prefix=prefix,
             auth_mode=auth_mode,
             log_clean=log_clean,  # 2.2.0 - support for log_clean
+            log_max_size=log_max_size,  # 2.4.0 - support for log rotation
+            log_gzip=log_gzip,  # 2.4.0 - support for log rotation
+            results=self._open_results(results or []),
         )
 
+        # New 2.4.0 - support for cassettes (record / replay)
+        self.rt.cassette = self._open_cassette(record, replay)
+
+        # New 2.4.0 - support for rate limits
+        self.rt.rate_share = rate_share
+
+        # New 2.4.0 - support for the run deadline
+        self.rt.deadline = deadline
+
         self._batches = {}
 
         self.forced_stop_on_error = stop_on_error
         self.forced_log_file = log_file
         self.forced_base_url = base_url
+        self.forced_pool = {k: v for k, v in (pool or {}).items() if v is not None}
+        self.forced_rate = rate
         self.quiet = quiet
         self.delay = delay
-        self.no_colors = no_colors
         # API prefix URL  (append to base_url)
         self.prefix = prefix
         self.auth_mode = auth_mode
@@ -63,13 +114,84 @@ class RESTestParser:
         self._included = {}
 
         # New 2.0 - support for recording of timings
-        self.timings = Timings()
+        self.timings = Timings(timings, timings_params, profile)
+
+        # New 2.4.0 - support for per-phase profiling
+        if profile:
+            self.rt.profiler = Profiler()
 
         # New 2.4.0 - support for debug_file_name
         self.debug_file_name = debug_file_name
 
+        # New 2.4.0 - support for parallel sections
+        self.jobs = jobs
+        self.worker = False
+        self._pending = ""
+
+        # New 2.4.0 - scripts are compiled (and cached) before execution
+        self._handlers = {
+            n[len("_method_") :]: getattr(type(self), n)
+            for n in dir(type(self))
+            if n.startswith("_method_")
+        }
+        self.compiler = ScriptCompiler(
+            self._handlers.keys(),
+            self._json_load,
+            default_cache_dir() if cache_dir is None else cache_dir,
+        )
+
+    def _open_results(self, fnames):
+        sinks = []
+
+        for fname in fnames:
+            try:
+                sinks.append(open_result_sink(fname))
+            except (ValueError, OSError) as e:
+                sys.stderr.write("%s: %s\n" % (xcolored(self, "ERROR", "red"), e))
+                sys.exit(1)
+
+        return Results(sinks)
+
+    def _open_cassette(self, record, replay):
+        if not record and not replay:
+            return None
+
+        try:
+            if replay:
+                return Cassette(replay, "replay")
+
+            return Cassette(record, "record")
+        except (CassetteError, OSError) as e:
+            sys.stderr.write("%s: %s\n" % (xcolored(self, "ERROR", "red"), e))
+            sys.exit(1)
+
+    def _compile(self, fname):
+        try:
+            return self.compiler.compile(fname)
+        except ScriptError as e:
+            sys.stderr.write(
+                "%s: %s\n"
+                % (xcolored(self, "ERROR", "red", "on_white", ["reverse"]), e)
+            )
+            sys.exit(1)
+
+    def _debug_file_name(self, fname):
+        if not self.debug_file_name:
+            return
+
+        print(
+            "\n%s\n%s: executing file %s\n%s\n"
+            % (
+                "=" * 70,
+                xcolored(self, "DEBUG", "blue"),
+                xcolored(self, fname, "yellow"),
+                "=" * 70,
+            )
+        )
+
     def open(self, fname):
-        self.script = self._json_load(fname)
+        self.script = self._compile(fname)
+        self._debug_file_name(fname)
 
         self._abs_script_path = os.path.dirname(os.path.abspath(fname))
 
@@ -86,20 +208,85 @@ class RESTestParser:
         if self.forced_log_file is not None:
             self.rt.log_file = self.forced_log_file
 
-        self._actions(self.script["actions"])
+        for k, v in self.forced_pool.items():
+            setattr(self.rt, k, v)
+
+        # 2.4.0 - --rate overrides the global rate of the 'system' section
+        if self.forced_rate is not None:
+            rate = self.rt.rate if isinstance(self.rt.rate, dict) else {}
+            self.rt.rate = dict(rate, rps=self.forced_rate)
+
+        self._actions(self.script.actions)
 
     def export_csv(self, fname):
         self.timings.export_csv(fname)
 
+    def close(self):
+        self.rt.close()
+
+    # 2.4.0 - support for parallel sections
+    def fork(self):
+        w = copy.copy(self)
+
+        w.rt = self.rt.fork()
+        w.timings = self.timings.new()
+        w.worker = True
+        w._pending = ""
+
+        w._paths = list(self._paths)
+        w._batches = self._batches.copy()
+
+        return w
+
+    def join(self, w):
+        self.rt.join(w.rt)
+        self.timings.merge(w.timings)
+
+    def _actions_parallel(self, actions, jobs):
+        # every action runs in its own worker, so that globals set by one action
+        # are never seen by its siblings and the merge order is the script order
+        workers = [self.fork() for _ in actions]
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = [pool.submit(w._actions, [a]) for w, a in zip(workers, actions)]
+
+            try:
+                for f in futures:
+                    f.result()
+            except DeadlineExceeded:
+                # the workers stopped by the deadline are merged too,
+                # so that their timings are still exported
+                for f in futures:
+                    f.cancel()
+                pool.shutdown()
+                for w in workers:
+                    self.join(w)
+                raise
+            except BaseException:
+                for f in futures:
+                    f.cancel()
+                raise
+
+        for w in workers:
+            self.join(w)
+
     def _actions(self, actions):
         for act in actions:
+            # 2.4.0 - the run stops at the deadline
+            if self.rt.deadline:
+                self.rt.deadline.check()
+
             if "title" in act:
                 print("\n ==", act["title"])
 
-            action = act.get("method", act.get("action", "")).lower()
+            # 2.4.0 - compiled actions already know their kind
+            if isinstance(act, Action):
+                action = act.kind
+            else:
+                action = act.get("method", act.get("action", "")).lower()
+
             if action:
-                meth = getattr(self, "_method_" + action)
-                res = meth(act)
+                res = self._handlers[action](self, act)
                 if not res:
                     print("=== RES: ", json.dumps(res, indent=4, default=str))
                     sys.stderr.write(
@@ -109,34 +296,139 @@ class RESTestParser:
 
                     sys.exit(1)
 
-            if "actions" in act:
+            # 2.4.0 - children of an action are run by the action itself,
+            # only plain grouping items (with no action) run them here
+            elif "actions" in act:
                 self._actions(act["actions"])
 
+    def _out(self, txt):
+        # 2.4.0 - parallel workers only write whole lines, so that the
+        # output of concurrent requests does not get mixed up on the console
+        if self.worker:
+            self._pending += txt
+            pos = self._pending.rfind("\n") + 1
+            if not pos:
+                return
+            txt = self._pending[:pos]
+            self._pending = self._pending[pos:]
+
+        sys.stdout.write(txt)
+        sys.stdout.flush()
+
     def _parse_files(self, dct):
+        # 2.4.0 - files are not opened here anymore: they are streamed
+        #         (and closed) by the multipart encoder while sending
         files = {}
 
         for k, v in dct.items():
             if isinstance(v, list):
-                _v = []
-                for f in v:
-                    n = self._resolve_fname(f)
-                    _v.append(open(n, "rb"))
-
-                files[k] = _v
+                files[k] = [self._file_part(f) for f in v]
             else:
-                v = self._resolve_fname(v)
-                files[k] = open(v, "rb")
+                files[k] = self._file_part(v)
 
         return files
 
-    def _send_req(self, act, counter):
+    def _file_part(self, v):
+        # 2.4.0 - { "generate": "10MB", "filename": "blob.bin" } uploads a generated payload
+        if isinstance(v, dict):
+            if "generate" not in v:
+                sys.stderr.write(
+                    "%s: invalid file definition: %s\n"
+                    % (xcolored(self, "ERROR", "red"), v)
+                )
+                sys.exit(1)
+
+            return GeneratedPart(
+                str2size(v["generate"]), v.get("filename", "payload.bin")
+            )
+
+        return FilePart(self._resolve_fname(v))
+
+    def _exec_args(self, act):
+        # 2.4.0 - builds the arguments for RESTest.do_EXEC() from an action,
+        #         once for all the iterations (internal_info is added by _send_req)
         m = act["method"].upper()
 
         # 2.0.1 - support for auth_mode flag
         auth = act.get("auth", True if self.rt.auth_mode == "auth" else False)
-        content = act.get("content", "json")
 
-        files = self._parse_files(act.get("files", {}))
+        # 2.2.0 - support for "body" as alternative to "params" and "data"
+        params = act.get("body", act.get("params", act.get("data", {})))
+
+        ignore = False
+        if "ignore_error" in act:
+            ignore = act["ignore_error"]
+        elif "skip_error" in act:
+            sys.stderr.write(
+                "%s 'skip_error' is deprecated use 'ignore_error' in actions\n"
+                % (xcolored(self, "WARNING", "yellow"))
+            )
+            ignore = act["skip_error"]
+
+        return {
+            "meth": m,
+            "endpoint": act["url"],
+            "data": DataTemplate(params),
+            "authenticated": auth,
+            "status_code": act.get("status_code", act.get("status", 200)),
+            "skip_error": ignore,
+            "no_cookies": act.get("no_cookies", False),
+            "max_exec_time": act.get("max_time", 0),
+            "title": act.get("title", "No title provided"),
+            "files": self._parse_files(act.get("files", {})),
+            "content": act.get("content", "json"),
+            # New 1.91 - support for custom headers in single call
+            "headers": act.get("headers", {}),
+            # New 1.92 - support for custom cookies in single call
+            "cookies": act.get("cookies", {}),
+            # New 2.4.0 - support for the HTTP cache (GET only)
+            "cache": act.get("cache"),
+            # New 2.4.0 - support for retries
+            "retry": self._retry_policy(act.get("retry")),
+            # New 2.4.0 - support for timeouts
+            "timeout": self._timeout(act.get("timeout")),
+        }
+
+    def _retry_policy(self, opts):
+        # 2.4.0 - retry policies of actions are compiled once
+        if not opts:
+            return opts
+
+        try:
+            return RetryPolicy(opts)
+        except (TypeError, ValueError) as e:
+            sys.stderr.write(
+                "%s: invalid retry policy %s: %s\n"
+                % (xcolored(self, "ERROR", "red"), opts, e)
+            )
+            sys.exit(1)
+
+    def _timeout(self, opts):
+        # 2.4.0 - timeouts (30, or { "connect": 3, "read": 30 }) become a
+        #         (connect, read) tuple: 0 (or a missing key) means no timeout
+        if opts is None:
+            return None
+
+        if isinstance(opts, dict):
+            timeouts = (opts.get("connect"), opts.get("read"))
+        else:
+            timeouts = (opts, opts)
+
+        try:
+            return tuple(float(t) if t else None for t in timeouts)
+        except (TypeError, ValueError):
+            sys.stderr.write(
+                "%s: invalid timeout: %s\n" % (xcolored(self, "ERROR", "red"), opts)
+            )
+            sys.exit(1)
+
+    def _send_req(self, act, counter, args=None):
+        if args is None:
+            args = self._exec_args(act)
+
+        m = args["meth"]
+        auth = args["authenticated"]
+        params = args["data"].source
 
         if m == "POST":
             _col = "blue"
@@ -147,11 +439,8 @@ class RESTestParser:
         else:
             _col = "white"
 
-        # 2.2.0 - support for "body" as alternative to "params" and "data"
-        params = act.get("body", act.get("params", act.get("data", {})))
-
         if not self.quiet:
-            sys.stdout.write(
+            self._out(
                 "%s %s %s %s %s %s"
                 % (
                     self.rt._tabs(),
@@ -162,7 +451,6 @@ class RESTestParser:
                     xcolored(self, auth, "blue"),
                 )
             )
-            sys.stdout.flush()
 
         # 2.2.0 - if params is present, but it is not a dict return an error
         if params and not isinstance(params, dict):
@@ -175,51 +463,18 @@ class RESTestParser:
         # New 2.1.0 - support for skip flag
         if act.get("skip", False):
             if not self.quiet:
-                sys.stdout.write(" - %s\n" % xcolored(self, "SKIP", "yellow"))
-                sys.stdout.flush()
+                self._out(" - %s\n" % xcolored(self, "SKIP", "yellow"))
             return None
 
-        # New 1.91 - support for custom headers in single call
-        headers = act.get("headers", {})
-
-        # New 1.92 - support for custom cookies in single call
-        cookies = act.get("cookies", {})
-
-        ignore = False
-        if "ignore_error" in act:
-            ignore = act["ignore_error"]
-        elif "skip_error" in act:
-            sys.stderr.write(
-                "%s 'skip_error' is deprecated use 'ignore_error' in actions\n"
-                % (xcolored(self, "WARNING", "yellow"))
-            )
-            ignore = act["skip_error"]
-
-        self.timings.start(m, act["url"], params)
+        self.rt.profiler.begin("%s %s" % (m, act["url"]))
+        self.timings.start(m, act["url"], params, self.rt.profiler.current)
 
         try:
-            res = self.rt.do_EXEC(
-                m,
-                act["url"],
-                params,
-                auth,
-                status_code=act.get("status_code", act.get("status", 200)),
-                skip_error=ignore,
-                no_cookies=act.get("no_cookies", False),
-                max_exec_time=act.get("max_time", 0),
-                title=act.get("title", "No title provided"),
-                files=files,
-                content=content,
-                headers=headers,
-                cookies=cookies,
-                internal_info={
-                    "counter": counter + 1,
-                },
-            )
+            res = self.rt.do_EXEC(internal_info={"counter": counter + 1}, **args)
 
-            data = self.timings.end(res.status_code)
-            start_time = data["start_time"]
-            end_time = data["end_time"]
+            elapsed = self.timings.end(
+                res.status_code, self.rt.rate_wait_ns, self.rt.retries, self.rt.retry_ns
+            )
 
             # 2.1.0 - support for response_size
             res.size = len(res.content)
@@ -241,51 +496,85 @@ class RESTestParser:
                         ["reverse", "blink"],
                     )
 
-                sys.stdout.write(
-                    " - size: %5s - status: %s - t: %s ms / %s s\n"
+                self._out(
+                    " - size: %5s - status: %s - t: %d ms / %.3f s%s\n"
                     % (
                         res.str_size,  # 2.1.0 - support for response_size
                         status,
-                        (end_time - start_time),
-                        (end_time - start_time) / 1000,
+                        elapsed,
+                        elapsed / 1000,
+                        # 2.4.0 - support for retries
+                        " - retries: %s" % self.rt.retries if self.rt.retries else "",
                     )
                 )
 
             return res
         except Exception as e:
-            if not self.quiet:
-                sys.stdout.write(
-                    " - status: %s\n\n%s\n"
-                    % (
-                        xcolored(
-                            self, "ERROR", "red", "on_white", ["reverse", "blink"]
-                        ),
-                        e,
-                    )
+            # some exceptions (eg. asyncio timeouts) have no message
+            err = str(e) or type(e).__name__
+
+            if self.rt.results:
+                self.rt.results.request(
+                    self.rt._section(),
+                    args["title"],
+                    m,
+                    act["url"],
+                    None,
+                    args["status_code"],
+                    None,
+                    None,
+                    False,
+                    err,
                 )
 
-                sys.exit(1)
+            if not self.quiet:
+                self._out(
+                    " - status: %s\n"
+                    % xcolored(self, "ERROR", "red", "on_white", ["reverse", "blink"])
+                )
 
-            return None
+            # 2.4.0 - request errors (retries exhausted, circuit open, ...) are
+            #         handled like failed tests: they stop the run on stop_on_error
+            return self.rt._error("REQUEST: %s %s - %s" % (m, act["url"], err))
 
     def _method_exec(self, act):
-        repeat = act.get("repeat", 1)
-        orig_act = deepcopy(act)
+        # 2.4.0 - support for load test mode
+        if not act.get("skip", False) and any(
+            k in act for k in ("concurrency", "rps", "duration")
+        ):
+            return LoadRunner(self, act).run()
+
+        # 2.4.0 - the action is never changed by a request: it is compiled once,
+        #         and the iterations only differ by the internal counter
+        args = self._exec_args(act)
 
-        for i in range(repeat):
-            act = deepcopy(orig_act)
-            res = self._send_req(act, i)
+        for i in range(act.get("repeat", 1)):
+            res = self._send_req(act, i, args)
 
-            # if 'save_cookies' in act: self.rt.save_cookies ( res, act [ 'save_cookies' ] )
-            if "fields" in act:
-                self.rt.fields(res, act["fields"])
-            if "tests" in act:
-                self.rt.check(res, act["tests"])
-            if "dumps" in act:
-                self.rt.dumps(res, act["dumps"])
+            self._post_process(act, res)
 
         return True
 
+    def _post_process(self, act, res):
+        if res is None:
+            return
+
+        prof = self.rt.profiler
+
+        # if 'save_cookies' in act: self.rt.save_cookies ( res, act [ 'save_cookies' ] )
+        if "fields" in act:
+            t = prof.start()
+            self.rt.fields(res, act["fields"])
+            prof.stop("fields", t)
+        if "tests" in act:
+            t = prof.start()
+            self.rt.check(res, act["tests"])
+            prof.stop("check", t)
+        if "dumps" in act:
+            t = prof.start()
+            self.rt.dumps(res, act["dumps"])
+            prof.stop("fields", t)
+
     def _method_get(self, act):
         if "method" not in act:
             act["method"] = "get"
@@ -317,7 +606,22 @@ class RESTestParser:
             print("\n%s====== %s" % (self.rt._tabs(), xcolored(self, title, "green")))
 
         self.rt.section_start(title)
-        self._actions(act["actions"])
+
+        # 2.4.0 - rate limit of the section requests (parallel workers included)
+        bucket = None
+        if act.get("rate"):
+            bucket = self.rt.rate_limiter().new_bucket(act["rate"])
+            self.rt.rate_buckets.append(bucket)
+
+        # 2.4.0 - support for parallel sections
+        if act.get("parallel", False):
+            self._actions_parallel(act["actions"], act.get("jobs", self.jobs))
+        else:
+            self._actions(act["actions"])
+
+        if bucket:
+            self.rt.rate_buckets.pop()
+
         self.rt.section_end()
 
         if not self.quiet:
@@ -327,6 +631,137 @@ class RESTestParser:
 
         return True
 
+    # 2.4.0 - support for data driven loops
+    def _method_foreach(self, act):
+        fname = self._resolve_fname(self.rt._expand_var(act["file"]))
+
+        rng = act.get("range", [0, None])
+        if (
+            not isinstance(rng, list)
+            or len(rng) != 2
+            or not isinstance(rng[0], int)
+            or not isinstance(rng[1], (int, type(None)))
+        ):
+            sys.stderr.write(
+                "%s: foreach: 'range' must be [ start, end ] (end can be null): %s\n"
+                % (xcolored(self, "ERROR", "red", "on_white", ["reverse"]), rng)
+            )
+            sys.exit(1)
+
+        if not self.quiet:
+            print(
+                "\n%s====== FOREACH %s"
+                % (self.rt._tabs(), xcolored(self, act["file"], "green"))
+            )
+
+        rows = itertools.islice(self._rows(fname, act.get("format")), rng[0], rng[1])
+        prefix = act.get("prefix", "")
+
+        if act.get("parallel", False):
+            self._foreach_parallel(
+                rows, act["actions"], prefix, act.get("jobs", self.jobs)
+            )
+        else:
+            for row in rows:
+                self._bind_row(self.rt.globals, row, prefix)
+                self._actions(act["actions"])
+
+        return True
+
+    def _foreach_parallel(self, rows, actions, prefix, jobs):
+        # every row runs in its own worker, and workers are merged back in row order;
+        # rows are read only as workers are free, so that memory stays constant
+        jobs = max(1, jobs)
+        pending = collections.deque()
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            try:
+                for row in rows:
+                    w = self.fork()
+                    self._bind_row(w.rt.globals, row, prefix)
+                    pending.append((w, pool.submit(w._actions, actions)))
+
+                    while len(pending) >= 2 * jobs:
+                        self._join_next(pending)
+
+                while pending:
+                    self._join_next(pending)
+            except DeadlineExceeded:
+                # the rows stopped by the deadline are merged too (see _actions_parallel)
+                for _, f in pending:
+                    f.cancel()
+                pool.shutdown()
+                for w, _ in pending:
+                    self.join(w)
+                raise
+            except BaseException:
+                for _, f in pending:
+                    f.cancel()
+                raise
+
+    def _join_next(self, pending):
+        # a worker is removed only when done, so that it is merged on deadline
+        w, f = pending[0]
+        f.result()
+        pending.popleft()
+        self.join(w)
+
+    def _bind_row(self, glob, row, prefix):
+        for k, v in row.items():
+            glob[prefix + k] = v
+
+    def _rows(self, fname, fmt=None):
+        # yields the rows of a CSV or JSONL file (plain, .gz or .bz2), one at a time
+        if not fmt:
+            base = fname[:-3] if fname.endswith(".gz") else fname
+            base = base[:-4] if base.endswith(".bz2") else base
+            fmt = os.path.splitext(base)[1][1:].lower()
+
+        if fmt not in ("csv", "jsonl", "ndjson"):
+            sys.stderr.write(
+                "%s: foreach: unknown data format '%s' (use csv or jsonl): %s\n"
+                % (xcolored(self, "ERROR", "red", "on_white", ["reverse"]), fmt, fname)
+            )
+            sys.exit(1)
+
+        f = self._open_text(fname)
+        try:
+            if fmt == "csv":
+                yield from csv.DictReader(f)
+                return
+
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+
+                if not isinstance(row, dict):
+                    sys.stderr.write(
+                        "%s: %s: line %s is not a JSON object\n"
+                        % (
+                            xcolored(self, "ERROR", "red", "on_white", ["reverse"]),
+                            fname,
+                            n,
+                        )
+                    )
+                    sys.exit(1)
+
+                yield row
+        finally:
+            f.close()
+
+    def _open_text(self, fname):
+        if fname.endswith(".gz"):
+            return gzip.open(fname, "rt", encoding="utf-8", newline="")
+        if fname.endswith(".bz2"):
+            return bz2.open(fname, "rt", encoding="utf-8", newline="")
+
+        return open(fname, "r", encoding="utf-8", newline="")
+
     def _method_copy(self, act):
         self.rt.copy_val(act["from"], act["to"])
 
@@ -358,19 +793,23 @@ class RESTestParser:
 
         self._paths.append(os.path.dirname(fname))
 
-        script = self._json_load(fname)
+        # 2.4.0 - included scripts are usually compiled with the main script
+        script = getattr(act, "script", None)
+        if script is None or script.fname != fname:
+            script = self._compile(fname)
 
         skip_include = False
-        if script.get("run-once", False) and fname in self._included:
+        if script.run_once and fname in self._included:
             skip_include = True
         if not skip_include:
             self._included[fname] = 1
             if "name" in act:
                 name = act["name"].lower()
-                self._batches[name] = script["actions"]
+                self._batches[name] = script.actions
 
             if "exec" in act and act["exec"] is True:
-                self._actions(script["actions"])
+                self._debug_file_name(fname)
+                self._actions(script.actions)
 
         self._paths.pop()
 
@@ -430,14 +869,39 @@ class RESTestParser:
     def _parse_system(self):
         self.rt.sections = []
 
-        system = self.script.get("system")
+        system = self.script.system
 
         if not system:
             return
 
         for k, v in system.items():
+            # 2.4.0 - Python files registering custom test modes
+            if k == "plugins":
+                self._load_plugins(v)
+                continue
+
+            # 2.4.0 - the retry policy is checked before running
+            if k == "retry":
+                self._retry_policy(v)
+
+            # 2.4.0 - timeouts are stored as (connect, read)
+            if k == "timeout":
+                v = self._timeout(v)
+
             setattr(self.rt, k, v)
 
+    def _load_plugins(self, fnames):
+        for fname in fnames:
+            fname = self._resolve_fname(fname)
+            try:
+                load_plugin(fname)
+            except Exception as e:
+                sys.stderr.write(
+                    "%s: could not load plugin %s: %s\n"
+                    % (xcolored(self, "ERROR", "red"), fname, e)
+                )
+                sys.exit(1)
+
     def _json_load(self, fname):
         # load gzip file
         if fname.endswith(".gz"):
@@ -449,17 +913,6 @@ class RESTestParser:
 
         try:
             data = json.load(f)
-
-            if self.debug_file_name:
-                print(
-                    "\n%s\n%s: executing file %s\n%s\n"
-                    % (
-                        "=" * 70,
-                        xcolored(self, "DEBUG", "blue"),
-                        xcolored(self, fname, "yellow"),
-                        "=" * 70,
-                    )
-                )
         except Exception as e:
             sys.stderr.write(
                 "%s: error parsing JSON file: %s\n"
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import functools
 import re
 import sys
 
@@ -24,6 +25,10 @@ def _parse_square(tokens, pos):
     if _is_int(tok):
         return {"mode": "pos", "value": int(str(tok), 10)}, pos + 2
 
+    # 2.4.0 - [*] selects all the elements of a list
+    if tok == "*":
+        return {"mode": "all"}, pos + 2
+
     return _parser(tokens, pos, is_pattern=True)
 
 
@@ -79,10 +84,51 @@ def path_parser(path):
     return _parser(tokens, 0)[0]
 
 
-def _find_in_list(field_name, tok, elem: list):
-    equal = tok["mode"] == "equal"
-    val = str(tok["value"])
+# 2.4.0 - paths are compiled once in a "program": a tuple of (op, value) steps
+OP_LABEL = 0  # value: key name
+OP_POS = 1  # value: list index
+OP_FIND = 2  # value: (field name, equal, value)
+OP_SUB = 3  # value: sub program, run on the current element
+OP_ALL = 4  # value: (program run on every element, True if it has an OP_ALL too)
+
+PATH_CACHE_SIZE = 4096
+
+
+def _assemble(parsed_path):
+    prog = []
+    field_name = ""
+
+    for i, tok in enumerate(parsed_path):
+        if isinstance(tok, dict) and tok["mode"] == "all":
+            # the rest of the path is run on every element of the list
+            rest = _assemble(parsed_path[i + 1 :])
+            prog.append((OP_ALL, (rest, any(op == OP_ALL for op, _ in rest))))
+            break
+
+        if isinstance(tok, list):
+            prog.append((OP_SUB, _assemble(tok)))
+        elif tok["mode"] == "label":
+            prog.append((OP_LABEL, tok["value"]))
+        elif tok["mode"] == "pos":
+            prog.append((OP_POS, tok["value"]))
+        elif tok["mode"] == "pattern":
+            field_name = tok["value"]
+        elif tok["mode"] in ("equal", "not_equal"):
+            prog.append(
+                (OP_FIND, (field_name, tok["mode"] == "equal", str(tok["value"])))
+            )
+
+    return tuple(prog)
+
 
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def compile_path(path):
+    _check_path_quotes(path)
+
+    return _assemble(path_parser(path))
+
+
+def _find_in_list(field_name, equal, val, elem):
     pos = 0
     found = False
     el = None
@@ -112,44 +158,120 @@ def _find_in_list(field_name, tok, elem: list):
     return el, None
 
 
-def _expand(parsed_path, pos, dct):
-    elem = dct
-    field_name = ""
-    err = ""
+class ListIndex:
+    """
+    Hash indexes for the [key=value] lookups on the lists of one document.
 
-    while pos < len(parsed_path):
-        tok = parsed_path[pos]
-        pos += 1
+    The first lookup on a list (by a key) scans the list, as usual. The
+    second one builds an index of the list by that key (value -> position
+    of the first element with that value), used by every later lookup.
+    Lists are kept referenced by the index, so that they are not collected
+    (and their id reused) while the index exists.
+    """
 
-        if isinstance(tok, list):
-            elem, err = _expand(tok, 0, elem)
-        elif tok["mode"] == "label":
-            n = tok["value"]
+    __slots__ = ("_lists",)
+
+    def __init__(self):
+        # (list id, key) -> [list, index, position of the first element without the key]
+        self._lists = {}
+
+    def find(self, field_name, val, lst):
+        # returns (element, error) like _find_in_list(), or None if not indexed yet
+        k = (id(lst), field_name)
+
+        e = self._lists.get(k)
+        if e is None:
+            self._lists[k] = [lst, None, -1]
+            return None
+
+        if e[1] is None:
+            self._build(e, field_name)
+
+        pos = e[1].get(val)
+        if pos is not None:
+            return lst[pos], None
+
+        if e[2] != -1:
+            return None, "Could not find key: %s" % field_name
+
+        return None, None
+
+    def _build(self, e, field_name):
+        idx = {}
+
+        for pos, el in enumerate(e[0]):
+            # the scan stops at the first element without the key
+            if field_name not in el:
+                e[2] = pos
+                break
+
+            idx.setdefault(str(el[field_name]), pos)
+
+        e[1] = idx
+
+
+def _run_all(prog, nested, elem, index=None):
+    if not isinstance(elem, list):
+        return None, "Expected a list, got: %s" % type(elem)
+
+    # fast path for the most common case: list.[*].key
+    if len(prog) == 1 and prog[0][0] == OP_LABEL:
+        key = prog[0][1]
+        try:
+            return [el[key] for el in elem], None
+        except (KeyError, TypeError):
+            pass
+
+    res = []
+    for pos, el in enumerate(elem):
+        v, err = _run(prog, el, index)
+        if err:
+            return None, "[%s]: %s" % (pos, err)
+
+        # nested wildcards return a single flat list
+        if nested:
+            res.extend(v)
+        else:
+            res.append(v)
+
+    return res, None
+
+
+def _run(prog, elem, index=None):
+    for op, val in prog:
+        if op == OP_LABEL:
             if not elem:
                 elem = {}
-            if n in elem:
-                elem = elem[n]  # tok [ 'value' ] ]
-            else:
-                err = "Could not find key: '%s'" % n
-        elif tok["mode"] == "pos":
-            _pos = tok["value"]
-            if len(elem) > _pos:
-                elem = elem[_pos]
-            else:
-                err = "Index out of bounds: %s (max: %s) [%s]" % (
-                    _pos,
+            if val not in elem:
+                return None, "Could not find key: '%s'" % val
+            elem = elem[val]
+        elif op == OP_POS:
+            if len(elem) <= val:
+                return None, "Index out of bounds: %s (max: %s) [%s]" % (
+                    val,
                     len(elem) - 1,
                     elem,
                 )
-        elif tok["mode"] == "pattern":
-            field_name = tok["value"]
-        elif tok["mode"] in ("equal", "not_equal"):
-            elem, err = _find_in_list(field_name, tok, elem)
-
-        if err:
-            return None, err
-
-    return elem, err
+            elem = elem[val]
+        elif op == OP_FIND:
+            res = None
+            # 2.4.0 - lookups by equality use the index of the document
+            if index is not None and val[1] and isinstance(elem, list):
+                res = index.find(val[0], val[2], elem)
+            if res is None:
+                res = _find_in_list(val[0], val[1], val[2], elem)
+
+            elem, err = res
+            if err:
+                return None, err
+        elif op == OP_ALL:
+            return _run_all(val[0], val[1], elem, index)
+        else:
+            elem, err = _run(val, elem, index)
+            if err:
+                return None, err
+
+    return elem, None
 
 
 def _check_path_quotes(path):
@@ -181,14 +303,9 @@ def _check_path_quotes(path):
         return False
 
 
-def expand_value(path, dct):
-    _check_path_quotes(path)
-
-    parsed_path = path_parser(path)
-
-    res, err = _expand(parsed_path, 0, dct)
-
-    return res, err
+def expand_value(path, dct, index=None):
+    # index: the ListIndex of the document, to speed up [key=value] lookups
+    return _run(compile_path(path), dct, index)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# restest connection pool
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import http.cookiejar
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class ConnectionStats:
+    """
+    Counts the requests sent and the new connections opened to send them:
+    every other request reused a keep-alive connection.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.new = 0
+        self._lock = threading.Lock()
+
+    @property
+    def reused(self):
+        return max(0, self.requests - self.new)
+
+    def add(self, requests=0, new=0):
+        with self._lock:
+            self.requests += requests
+            self.new += new
+
+    def summary(self):
+        return "%s requests - %s new connections - %s reused (%.1f%%)" % (
+            self.requests,
+            self.new,
+            self.reused,
+            100.0 * self.reused / self.requests if self.requests else 0,
+        )
+
+
+def _counting(cls, stats):
+    # a connection class counting the connections opened (reconnects included)
+    class CountingConnection(cls):
+        def connect(self):
+            stats.add(new=1)
+            return super().connect()
+
+    return CountingConnection
+
+
+def _pool_classes(stats):
+    class CountingHTTPPool(HTTPConnectionPool):
+        ConnectionCls = _counting(HTTPConnectionPool.ConnectionCls, stats)
+
+    class CountingHTTPSPool(HTTPSConnectionPool):
+        ConnectionCls = _counting(HTTPSConnectionPool.ConnectionCls, stats)
+
+    return {"http": CountingHTTPPool, "https": CountingHTTPSPool}
+
+
+class PoolAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that updates a ConnectionStats.
+
+    One adapter is shared by all the sessions of a run (parallel workers and
+    the cookie-less session included), so they all share the same pool of
+    keep-alive connections.
+    """
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _pool_classes(self.stats)
+
+    def send(self, request, **kwargs):
+        self.stats.add(requests=1)
+        return super().send(request, **kwargs)
+
+
+def no_cookies_session():
+    # a session that never stores (nor sends) cookies
+    s = requests.Session()
+    s.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    return s
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# restest profiler
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import time
+
+# phases of a request, in execution order
+PHASES = (
+    "template",  # variables expansion (url, body, headers)
+    "url",  # url resolution (and GET params)
+    "body",  # body serialization
+    "wait",  # rate limiter wait
+    "network",  # HTTP round trip
+    "headers",  # response headers parsing
+    "log",  # log file and Postman export
+    "curl",  # curl command rendering
+    "fields",  # fields and dumps path evaluation (body decoding included)
+    "check",  # tests evaluation
+)
+
+
+class NullProfiler:
+    """
+    The profiler used when profiling is off: it does nothing, as fast as possible.
+    """
+
+    current = None
+
+    def __bool__(self):
+        return False
+
+    def new(self):
+        return self
+
+    def begin(self, key):
+        pass
+
+    def start(self):
+        return 0
+
+    def stop(self, phase, start):
+        pass
+
+    def add(self, phase, ns):
+        pass
+
+    def merge(self, other):
+        pass
+
+
+class Profiler:
+    """
+    Times every phase of every request (see PHASES), in nanoseconds.
+
+    begin() starts a new request: the phases of the request are in `current`,
+    and they are summed up for every action (method + URL as written in the
+    script) in `actions`.
+    """
+
+    def __init__(self):
+        self.current = None
+        self._key = None
+
+        # key -> [count, {phase: ns}]
+        self.actions = {}
+
+    def __bool__(self):
+        return True
+
+    def new(self):
+        # an empty profiler for parallel workers
+        return Profiler()
+
+    def begin(self, key):
+        self._flush()
+
+        self._key = key
+        self.current = dict.fromkeys(PHASES, 0)
+
+    def start(self):
+        return time.perf_counter_ns()
+
+    def stop(self, phase, start):
+        if self.current is not None:
+            self.current[phase] += time.perf_counter_ns() - start
+
+    def add(self, phase, ns):
+        if self.current is not None:
+            self.current[phase] += ns
+
+    def _flush(self):
+        if self.current is None:
+            return
+
+        stats = self.actions.get(self._key)
+        if stats is None:
+            stats = self.actions[self._key] = [0, dict.fromkeys(PHASES, 0)]
+
+        stats[0] += 1
+        for phase, ns in self.current.items():
+            stats[1][phase] += ns
+
+        self.current = None
+
+    def merge(self, other):
+        other._flush()
+
+        for key, (count, phases) in other.actions.items():
+            stats = self.actions.get(key)
+            if stats is None:
+                stats = self.actions[key] = [0, dict.fromkeys(PHASES, 0)]
+
+            stats[0] += count
+            for phase, ns in phases.items():
+                stats[1][phase] += ns
+
+    def report(self):
+        self._flush()
+
+        totals = dict.fromkeys(PHASES, 0)
+        count = 0
+
+        width = max([len(k) for k in self.actions] + [6])
+        head = "%-*s %6s" % (width, "action", "count") + "".join(
+            " %9s" % p for p in PHASES + ("total",)
+        )
+
+        lines = ["===== PROFILE (ms)", head]
+
+        for key, (n, phases) in sorted(
+            self.actions.items(), key=lambda a: -sum(a[1][1].values())
+        ):
+            count += n
+            for phase, ns in phases.items():
+                totals[phase] += ns
+
+            lines.append(self._row(width, key, n, phases))
+
+        lines.append(self._row(width, "TOTAL", count, totals))
+
+        total = sum(totals.values()) or 1
+        lines.append(
+            "%-*s %6s" % (width, "%", "")
+            + "".join(" %9.1f" % (100.0 * totals[p] / total) for p in PHASES)
+        )
+
+        return "\n".join(lines)
+
+    def _row(self, width, key, count, phases):
+        return (
+            "%-*s %6s" % (width, key, count)
+            + "".join(" %9.3f" % (phases[p] / 1000000) for p in PHASES)
+            + " %9.3f" % (sum(phases.values()) / 1000000)
+        )
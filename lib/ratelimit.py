@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+# restest rate limiter
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import threading
+import time
+import urllib.parse
+
+
+class RateStats:
+    """
+    Counts the requests delayed by the rate limiter, and the time they waited.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.delayed = 0
+        self.wait_ns = 0
+        self.max_wait_ns = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.requests)
+
+    def add(self, requests=0, delayed=0, wait_ns=0, max_wait_ns=0):
+        with self._lock:
+            self.requests += requests
+            self.delayed += delayed
+            self.wait_ns += wait_ns
+            self.max_wait_ns = max(self.max_wait_ns, max_wait_ns)
+
+    def summary(self):
+        return "%s requests - %s delayed - wait: %.3f s (max: %.1f ms)" % (
+            self.requests,
+            self.delayed,
+            self.wait_ns / 1000000000,
+            self.max_wait_ns / 1000000,
+        )
+
+
+class TokenBucket:
+    """
+    A token bucket refilled with `rate` tokens per second, holding at most
+    `burst` tokens (1 by default: requests are evenly spaced).
+
+    reserve() takes a token and returns how long the caller has to wait
+    before using it. Tokens can be taken in advance (the bucket goes below
+    zero), so that concurrent callers are queued one after the other: the
+    caller sleeps outside the lock, with time.sleep() or asyncio.sleep().
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self.rate
+
+
+def _bucket_opts(opts):
+    # opts is the requests per second, or { "rps": 10, "burst": 5 }
+    if isinstance(opts, dict):
+        return opts.get("rps", 0), opts.get("burst", 1)
+
+    return opts, 1
+
+
+class RateLimiter:
+    """
+    Limits the requests per second: globally, per host and per section.
+
+    `opts` is the requests per second, or a dict like:
+
+        { "rps": 10, "burst": 1, "hosts": { "api.example.com": 5 } }
+
+    where every host limit can also be a { "rps", "burst" } dict.
+    Hosts are matched by "host:port" first, then by host name.
+
+    With `share` > 1 (ie. when running on multiple processes) every limit is
+    divided by `share`, so that the processes together respect it.
+
+    The limiter is shared by all the workers of a run: a request waits for
+    all the buckets it goes through (global, host and enclosing sections).
+    """
+
+    def __init__(self, opts, stats, share=1):
+        if not isinstance(opts, dict):
+            opts = {"rps": opts}
+
+        self.stats = stats
+        self.share = max(1, share)
+
+        self.bucket = self.new_bucket(opts)
+        self.hosts = opts.get("hosts", {})
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def new_bucket(self, opts):
+        # returns a bucket for `opts` (see _bucket_opts), or None for no limit
+        rate, burst = _bucket_opts(opts)
+        if not rate:
+            return None
+
+        return TokenBucket(float(rate) / self.share, burst)
+
+    def _host_bucket(self, url):
+        netloc = urllib.parse.urlsplit(url).netloc
+
+        with self._lock:
+            if netloc not in self._hosts:
+                opts = self.hosts.get(netloc)
+                if opts is None:
+                    opts = self.hosts.get(netloc.rsplit(":", 1)[0])
+
+                self._hosts[netloc] = None if opts is None else self.new_bucket(opts)
+
+            return self._hosts[netloc]
+
+    def reserve(self, url, buckets=()):
+        """
+        Returns the seconds to wait before sending a request to `url`.
+        `buckets` are the buckets of the sections enclosing the request.
+        """
+        wait = 0
+
+        for b in (self.bucket, self._host_bucket(url) if self.hosts else None):
+            if b is not None:
+                wait = max(wait, b.reserve())
+
+        for b in buckets:
+            wait = max(wait, b.reserve())
+
+        ns = int(wait * 1000000000)
+        self.stats.add(requests=1, delayed=1 if ns else 0, wait_ns=ns, max_wait_ns=ns)
+
+        return wait
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# restest result sinks
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import atexit
+import csv
+import datetime
+import json
+import os
+import re
+import threading
+from xml.sax.saxutils import quoteattr
+
+# removes the colors from the messages
+rx_ansi = re.compile(r"\x1b\[[0-9;]*m")
+
+_open = []
+_open_lock = threading.Lock()
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="milliseconds")
+
+
+def _plain(txt):
+    if txt is None:
+        return None
+
+    return rx_ansi.sub("", str(txt))
+
+
+class ResultSink:
+    """
+    Base class of the result sinks.
+
+    Every request and every test result is passed to request() and test()
+    as soon as it is available, as a dict. Sinks write it immediately (and
+    flush it), so results can be read while the run is still going, and
+    nothing is lost if the run stops halfway. Sinks are shared by all the
+    workers, so writes are serialized by a lock.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._lock = threading.Lock()
+        self._fout = open(fname, "w", encoding="utf-8", newline="")
+        self._closed = False
+
+    def request(self, rec):
+        self._write(rec)
+
+    def test(self, rec):
+        self._write(rec)
+
+    def _write(self, rec):
+        with self._lock:
+            if self._closed:
+                return
+            self.write(rec)
+            self._fout.flush()
+
+    def write(self, rec):
+        raise NotImplementedError
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.finish()
+            self._fout.close()
+
+    def finish(self):
+        pass
+
+
+class JSONLSink(ResultSink):
+    def write(self, rec):
+        self._fout.write(json.dumps(rec, default=str) + "\n")
+
+
+class CSVSink(ResultSink):
+    FIELDS = (
+        "type",
+        "time",
+        "section",
+        "title",
+        "method",
+        "url",
+        "status",
+        "expected",
+        "duration",
+        "size",
+        "field",
+        "mode",
+        "value",
+        "ok",
+        "message",
+    )
+
+    def __init__(self, fname):
+        super().__init__(fname)
+
+        self._csv = csv.DictWriter(
+            self._fout, self.FIELDS, delimiter="\t", extrasaction="ignore"
+        )
+        self._csv.writeheader()
+
+    def write(self, rec):
+        self._csv.writerow(rec)
+
+
+class JUnitSink(ResultSink):
+    """
+    Every request and every test is a <testcase>.
+
+    The counters in the <testsuite> tag are written with a fixed width and
+    updated in place when the file is closed, so test cases can be streamed.
+    """
+
+    HEAD = (
+        '<testsuite name="restest" tests="%010d" failures="%010d" timestamp="%s">\n'
+    )
+
+    def __init__(self, fname):
+        super().__init__(fname)
+
+        self._tests = 0
+        self._failures = 0
+        self._timestamp = _now()
+
+        self._fout.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n'
+        )
+        self._head_pos = self._fout.tell()
+        self._fout.write(self.HEAD % (0, 0, self._timestamp))
+
+    def write(self, rec):
+        self._tests += 1
+
+        if rec["type"] == "request":
+            name = "%s %s" % (rec["method"], rec["url"])
+        else:
+            name = "%s %s %s" % (rec["field"], rec["mode"], rec["expected"])
+
+        self._fout.write(
+            "  <testcase classname=%s name=%s time=%s"
+            % (
+                quoteattr(rec["section"] or rec["title"] or "restest"),
+                quoteattr(_plain(name)),
+                quoteattr("%.3f" % ((rec.get("duration") or 0) / 1000)),
+            )
+        )
+
+        if rec["ok"]:
+            self._fout.write(" />\n")
+            return
+
+        self._failures += 1
+        self._fout.write(
+            ">\n    <failure message=%s />\n  </testcase>\n"
+            % quoteattr(rec["message"] or "")
+        )
+
+    def finish(self):
+        self._fout.write("</testsuite>\n</testsuites>\n")
+
+        self._fout.seek(self._head_pos)
+        self._fout.write(self.HEAD % (self._tests, self._failures, self._timestamp))
+
+
+SINKS = {
+    ".jsonl": JSONLSink,
+    ".csv": CSVSink,
+    ".xml": JUnitSink,
+}
+
+
+def shard_name(fname, shard):
+    # results.jsonl -> results.3.jsonl
+    base, ext = os.path.splitext(fname)
+    return "%s.%s%s" % (base, shard, ext)
+
+
+def open_result_sink(fname):
+    ext = os.path.splitext(fname)[1].lower()
+    if ext not in SINKS:
+        raise ValueError(
+            "unknown results format '%s' (use one of: %s)"
+            % (fname, ", ".join(sorted(SINKS)))
+        )
+
+    sink = SINKS[ext](fname)
+
+    with _open_lock:
+        _open.append(sink)
+
+    return sink
+
+
+class Results:
+    """
+    Sends the results to all the sinks (it is false when there are no sinks,
+    so callers can skip building the records).
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = sinks or []
+
+    def __bool__(self):
+        return bool(self.sinks)
+
+    def request(
+        self,
+        section,
+        title,
+        method,
+        url,
+        status,
+        expected,
+        duration,
+        size,
+        ok,
+        message=None,
+    ):
+        rec = {
+            "type": "request",
+            "time": _now(),
+            "section": section,
+            "title": title,
+            "method": method,
+            "url": url,
+            "status": status,
+            "expected": expected,
+            "duration": duration,
+            "size": size,
+            "ok": ok,
+            "message": _plain(message),
+        }
+
+        for s in self.sinks:
+            s.request(rec)
+
+    def test(self, section, title, field, mode, expected, value, ok, message=None):
+        rec = {
+            "type": "test",
+            "time": _now(),
+            "section": section,
+            "title": title,
+            "field": field,
+            "mode": mode,
+            "expected": expected,
+            "value": value,
+            "ok": ok,
+            "message": _plain(message),
+        }
+
+        for s in self.sinks:
+            s.test(rec)
+
+    def close(self):
+        for s in self.sinks:
+            s.close()
+
+
+def close_result_sinks():
+    with _open_lock:
+        sinks = list(_open)
+        _open.clear()
+
+    for s in sinks:
+        s.close()
+
+
+atexit.register(close_result_sinks)
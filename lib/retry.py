@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# restest retries and circuit breaker
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+
+# exception groups usable in "exceptions": they match the exceptions of both
+# engines (requests and aiohttp) by class name
+EXCEPTION_GROUPS = {
+    "connection": ("ConnectionError", "ClientConnectionError"),
+    "timeout": ("Timeout", "TimeoutError"),
+}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryStats:
+    """
+    Counts the retries, the requests that needed them and the time spent
+    retrying (failed attempts and backoff), plus the requests failed fast
+    because the circuit of their host was open.
+    """
+
+    def __init__(self):
+        self.retries = 0
+        self.requests = 0
+        self.retry_ns = 0
+        self.fast_fails = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.retries or self.fast_fails)
+
+    def add(self, retries=0, requests=0, retry_ns=0, fast_fails=0):
+        with self._lock:
+            self.retries += retries
+            self.requests += requests
+            self.retry_ns += retry_ns
+            self.fast_fails += fast_fails
+
+    def summary(self):
+        return "%s retries on %s requests - %.3f s - %s failed fast (circuit open)" % (
+            self.retries,
+            self.requests,
+            self.retry_ns / 1000000000,
+            self.fast_fails,
+        )
+
+
+class RetryPolicy:
+    """
+    When and how a failed request is sent again. `opts` is the max number of
+    attempts, or a dict like:
+
+        {
+            "attempts": 3,                          # attempts, the first one included
+            "status": [429, 502, 503, 504],         # status codes to retry
+            "exceptions": ["connection", "timeout"],
+            "methods": ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"],
+            "backoff": 0.5,                         # seconds, doubled on every retry
+            "max_backoff": 30,
+            "jitter": true,                         # random delay between 0 and backoff
+            "retry_after": true                     # honor the Retry-After header
+        }
+
+    Exceptions are matched by class name (the base classes included), or by
+    the groups in EXCEPTION_GROUPS.
+    """
+
+    def __init__(self, opts):
+        if not isinstance(opts, dict):
+            opts = {"attempts": opts}
+
+        self.attempts = max(1, int(opts.get("attempts", 3)))
+        self.status = frozenset(opts.get("status", (429, 502, 503, 504)))
+        self.methods = frozenset(
+            m.upper()
+            for m in opts.get("methods", ("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+        )
+        self.backoff = float(opts.get("backoff", 0.5))
+        self.max_backoff = float(opts.get("max_backoff", 30))
+        self.jitter = opts.get("jitter", True)
+        self.retry_after = opts.get("retry_after", True)
+
+        self.exceptions = set()
+        for name in opts.get("exceptions", ("connection", "timeout")):
+            self.exceptions.update(EXCEPTION_GROUPS.get(name, (name,)))
+
+    def allows(self, method):
+        return self.attempts > 1 and method in self.methods
+
+    def retry_exception(self, e):
+        return any(c.__name__ in self.exceptions for c in type(e).__mro__)
+
+    def retry_status(self, status_code):
+        return status_code in self.status
+
+    def delay(self, attempt, r=None):
+        # seconds to wait before the retry following `attempt` (1 based)
+        if r is not None and self.retry_after:
+            after = _retry_after(r.headers.get("Retry-After"))
+            if after is not None:
+                return min(after, self.max_backoff)
+
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+
+        return delay
+
+
+def _retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, when.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    Fails fast the requests to a host after `failures` consecutive failures
+    (exceptions or 5xx responses), for `reset` seconds. Then one request is
+    let through: if it succeeds the circuit is closed again, otherwise it
+    stays open for another `reset` seconds.
+
+    The breaker is shared by all the workers of a run.
+    """
+
+    def __init__(self, stats, failures=5, reset=30):
+        self.stats = stats
+        self.failures = max(1, int(failures))
+        self.reset = float(reset)
+
+        # host -> [consecutive failures, time the circuit was opened]
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url):
+        return urllib.parse.urlsplit(url).netloc
+
+    def check(self, host):
+        # raises CircuitOpenError if requests to `host` must fail fast
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[1] is None:
+                return
+
+            left = state[1] + self.reset - time.monotonic()
+            if left <= 0:
+                # half open: this request goes, the next ones wait for its result
+                state[1] = time.monotonic()
+                return
+
+        self.stats.add(fast_fails=1)
+        raise CircuitOpenError(
+            "circuit open for %s after %s failures (retry in %.1f s)"
+            % (host, state[0], left)
+        )
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host):
+        # returns True if the circuit is open (and the request must not be retried)
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, None])
+            state[0] += 1
+            if state[0] >= self.failures:
+                state[1] = time.monotonic()
+
+            return state[1] is not None
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+#
+# restest script compiler
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import contextlib
+import gc
+import hashlib
+import os
+import pickle
+
+# bump this every time Script / Action change, to invalidate the cached scripts
+CACHE_VERSION = 1
+
+HTTP_KINDS = ("get", "post", "put", "patch", "delete", "exec")
+
+# keys every action kind must have (HTTP actions only need the "url")
+REQUIRED_KEYS = {
+    "exec": ("method", "url"),
+    "section": ("actions",),
+    "set": ("key", "value"),
+    "copy": ("from", "to"),
+    "dump": ("fields",),
+    "include": ("filename",),
+    "batch_set": ("name", "actions"),
+    "batch_exec": ("name",),
+    "code": ("code",),
+    "sleep": ("ms",),
+    "if": ("field", "actions"),
+    "foreach": ("file", "actions"),
+}
+
+
+class ScriptError(Exception):
+    pass
+
+
+class Action(dict):
+    """
+    A validated action: the original JSON dict, plus the action kind resolved
+    at compile time and, for includes, the compiled included script.
+    """
+
+    __slots__ = ("kind", "script")
+
+    def __init__(self, dct, kind):
+        super().__init__(dct)
+        self.kind = kind
+        self.script = None
+
+
+class Script:
+    __slots__ = ("fname", "system", "actions", "run_once", "deps")
+
+    def __init__(self, fname, system, actions, run_once, deps):
+        self.fname = fname
+        self.system = system
+        self.actions = actions
+        self.run_once = run_once
+        # list of (fname, mtime_ns, size, digest) of the script and its includes
+        self.deps = deps
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    # building (or unpickling) a big tree of small objects triggers the GC over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _digest(fname):
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _dep(fname):
+    st = os.stat(fname)
+    return (fname, st.st_mtime_ns, st.st_size, _digest(fname))
+
+
+class ScriptCompiler:
+    """
+    Turns a JSON script (and the scripts it includes) in a tree of Action objects.
+
+    `kinds` is the list of the supported action kinds, `load` is the function
+    used to read a JSON file. When `cache_dir` is set, compiled scripts are
+    pickled there, and reused as long as the script and all its includes
+    have the same mtime and size (or, failing that, the same content hash).
+    """
+
+    def __init__(self, kinds, load, cache_dir=None):
+        self.kinds = set(kinds)
+        self.load = load
+        self.cache_dir = cache_dir
+
+    def compile(self, fname):
+        fname = os.path.abspath(fname)
+
+        with _gc_paused():
+            script, fresh = self._cache_get(fname)
+            if script is None:
+                script = self._compile_file(fname, [])
+            if not fresh:
+                self._cache_put(fname, script)
+
+        return script
+
+    def _compile_file(self, fname, stack):
+        data = self.load(fname)
+
+        if not isinstance(data, dict):
+            raise ScriptError("%s: the script must be a JSON object" % fname)
+
+        system = data.get("system")
+        if system is not None and not isinstance(system, dict):
+            raise ScriptError("%s: 'system' must be an object" % fname)
+
+        deps = [_dep(fname)]
+        stack = stack + [fname]
+
+        actions = self._actions(
+            data.get("actions", []), fname, "actions", stack, deps
+        )
+
+        return Script(fname, system, actions, data.get("run-once", False), deps)
+
+    def _actions(self, lst, fname, path, stack, deps):
+        if not isinstance(lst, list):
+            raise ScriptError("%s: %s: must be a list" % (fname, path))
+
+        return [
+            self._action(act, fname, "%s[%s]" % (path, i), stack, deps)
+            for i, act in enumerate(lst)
+        ]
+
+    def _action(self, act, fname, path, stack, deps):
+        if not isinstance(act, dict):
+            raise ScriptError("%s: %s: an action must be an object" % (fname, path))
+
+        kind = act.get("method", act.get("action", ""))
+        if not isinstance(kind, str):
+            raise ScriptError("%s: %s: invalid action: %s" % (fname, path, kind))
+
+        kind = kind.lower()
+        if kind and kind not in self.kinds:
+            raise ScriptError("%s: %s: unknown action '%s'" % (fname, path, kind))
+
+        required = REQUIRED_KEYS.get(kind, ())
+        if kind in HTTP_KINDS and kind != "exec":
+            required = ("url",)
+
+        for k in required:
+            if k not in act:
+                raise ScriptError(
+                    "%s: %s: action '%s' requires the '%s' key" % (fname, path, kind, k)
+                )
+
+        res = Action(act, kind)
+
+        if "actions" in act:
+            res["actions"] = self._actions(
+                act["actions"], fname, path + ".actions", stack, deps
+            )
+
+        if kind == "include":
+            res.script = self._include(act["filename"], fname, stack, deps)
+
+        return res
+
+    def _include(self, filename, parent, stack, deps):
+        # includes are resolved relative to the including script, if the file
+        # can not be found (or it is a recursive include) it is compiled at run time
+        if not filename.startswith("/"):
+            filename = os.path.join(os.path.dirname(parent), filename)
+        filename = os.path.abspath(filename)
+
+        if filename in stack or not os.path.exists(filename):
+            return None
+
+        script = self._compile_file(filename, stack)
+        deps.extend(script.deps)
+
+        return script
+
+    def _cache_name(self, fname):
+        return os.path.join(
+            self.cache_dir,
+            hashlib.sha1(fname.encode("utf-8")).hexdigest() + ".pickle",
+        )
+
+    def _cache_get(self, fname):
+        # returns the cached script (or None) and False if the cache must be updated
+        if not self.cache_dir:
+            return None, True
+
+        try:
+            with open(self._cache_name(fname), "rb") as f:
+                version, script = pickle.load(f)
+        except Exception:
+            return None, False
+
+        if version != CACHE_VERSION:
+            return None, False
+
+        fresh = True
+        for i, (name, mtime, size, digest) in enumerate(script.deps):
+            try:
+                st = os.stat(name)
+                if st.st_mtime_ns == mtime and st.st_size == size:
+                    continue
+                if st.st_size != size or _digest(name) != digest:
+                    return None, False
+            except OSError:
+                return None, False
+
+            # same content, just touched: keep the script, store the new mtime
+            script.deps[i] = (name, st.st_mtime_ns, size, digest)
+            fresh = False
+
+        return script, fresh
+
+    def _cache_put(self, fname, script):
+        if not self.cache_dir:
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            tmp = self._cache_name(fname) + ".%s.tmp" % os.getpid()
+            with open(tmp, "wb") as f:
+                pickle.dump((CACHE_VERSION, script), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._cache_name(fname))
+        except OSError:
+            # the cache is just an optimization
+            pass
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "restest")
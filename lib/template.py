@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+#
+# restest templates
+#
+# written by Fabio Rotondo (fabio.rotondo@gmail.com)
+#
+
+import functools
+import json
+import re
+
+# a %(name)s reference, with optional conversion flags (eg. %(count)05d) or a %% escape
+rx_ref = re.compile(r"%\(([^)]*)\)([#0\- +]*\d*(?:\.\d+)?[diouxXeEfFgGcrsa])|%%")
+
+TEMPLATE_CACHE_SIZE = 4096
+
+
+class Template:
+    """
+    A string with %(name)s references, compiled once in a list of segments.
+
+    Segments are either literal strings or (name, conversion) tuples, and they
+    are rendered looking up only the referenced names in the mapping, so that
+    the mapping is never copied. Strings with no references are marked as
+    static and are never rendered at all.
+
+    Strings using % features not handled here fall back to the % operator.
+    """
+
+    __slots__ = ("source", "segments", "static", "internal", "fallback")
+
+    def __init__(self, source):
+        self.source = source
+        self.segments = []
+        self.static = source.find("%(") == -1
+        self.internal = False
+        self.fallback = False
+
+        if self.static:
+            return
+
+        # the __internal_xxx vars are taken from the engine internal info
+        if source.find("__internal_") != -1:
+            self.internal = True
+            source = source.replace("__internal_", "")
+            self.source = source
+
+        pos = 0
+        for m in rx_ref.finditer(source):
+            self._literal(source[pos : m.start()])
+
+            if m.group(0) == "%%":
+                self.segments.append("%")
+            else:
+                self.segments.append((m.group(1), m.group(2)))
+
+            pos = m.end()
+
+        self._literal(source[pos:])
+
+    def _literal(self, txt):
+        if not txt:
+            return
+
+        # a single % that is not a reference: let the % operator deal with it
+        if txt.find("%") != -1:
+            self.fallback = True
+
+        self.segments.append(txt)
+
+    def render(self, mapping):
+        if self.fallback:
+            return self.source % mapping
+
+        res = []
+        for seg in self.segments:
+            if isinstance(seg, str):
+                res.append(seg)
+            elif seg[1] == "s":
+                res.append(str(mapping[seg[0]]))
+            else:
+                res.append(("%" + seg[1]) % (mapping[seg[0]],))
+
+        return "".join(res)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source):
+    return Template(source)
+
+
+# marks a string with references in a DataTemplate plan
+_REF = object()
+
+
+def _plan(v, in_list=False):
+    # returns None for static values, _REF for strings with references, or
+    # the list of (key, plan) of the dynamic items of a dict / list
+    if isinstance(v, str):
+        return _REF if v.find("%(") != -1 else None
+
+    if isinstance(v, dict):
+        items = v.items()
+    elif isinstance(v, list) and not in_list:
+        # lists inside lists are not expanded
+        items = enumerate(v)
+    else:
+        return None
+
+    plan = []
+    for k, x in items:
+        p = _plan(x, isinstance(v, list))
+        if p is not None:
+            plan.append((k, p))
+
+    return plan or None
+
+
+def _render(rt, v, plan):
+    if plan is _REF:
+        return rt._expand_var(v)
+
+    res = v.copy()
+    for k, p in plan:
+        res[k] = _render(rt, v[k], p)
+
+    return res
+
+
+class DataTemplate:
+    """
+    A request body (a dict) compiled once, to be rendered many times.
+
+    The dynamic parts of the body (keys and strings with %(name)s references)
+    are found once: render() expands only them, and the dicts and lists that
+    do not change are shared with the source instead of being copied.
+    A body with no references at all is returned as it is, and its JSON
+    encoding is computed only once.
+
+    Bodies that are not dicts are expanded by the engine as usual.
+    """
+
+    __slots__ = ("source", "static", "direct", "_keys", "_plan", "_json")
+
+    def __init__(self, source):
+        self.source = source
+        self.direct = False
+        self._keys = False
+        self._plan = None
+        self._json = None
+
+        if not isinstance(source, dict):
+            self.static = False
+            return
+
+        # "__direct__" bodies are sent as they are
+        if "__direct__" in source:
+            self.source = source["__direct__"]
+            self.static = self.direct = True
+            return
+
+        self._keys = any(
+            isinstance(k, str) and k.find("%(") != -1 for k in source.keys()
+        )
+        self._plan = _plan(source)
+        self.static = not self._keys and self._plan is None
+
+    def render(self, rt):
+        if self.direct:
+            return self.source
+
+        if not isinstance(self.source, dict):
+            if type(self.source) is list:
+                return rt._expand_data_list(self.source)
+            return rt._expand_data(self.source)
+
+        rt._inner_count += 1
+
+        if self.static:
+            return self.source
+
+        if not self._keys:
+            return _render(rt, self.source, self._plan)
+
+        # keys are expanded too: the dict is built again, to keep the keys order
+        plan = dict(self._plan or [])
+        res = {}
+        for k, v in self.source.items():
+            if k in plan:
+                v = _render(rt, v, plan[k])
+            res[rt._expand_var(k)] = v
+
+        return res
+
+    def encoded(self):
+        # the JSON text and the encoded body of a static body
+        if self._json is None:
+            text = json.dumps(self.source, ensure_ascii=False, default=str)
+            self._json = (text, text.encode("utf-8"))
+
+        return self._json
@@ -1,56 +1,330 @@
 #!/usr/bin/env python3
 
 import datetime
+import math
 import time
+from array import array
 
+from .profiler import PHASES
+
+# 2.4.0 - histogram precision: 2 ** SUB_BITS sub buckets for every power of two (< 1% error)
+SUB_BITS = 7
+SUB_COUNT = 1 << SUB_BITS
+
+
+class Histogram:
+    """
+    An HDR-style histogram of durations (in microseconds).
+
+    Values are counted in log-linear buckets, so the memory used does not
+    depend on the number of values recorded and percentiles are exact
+    within 1%.
+    """
 
-class Timings:
     def __init__(self):
-        self.timings = []
-
-    def start(self, method, url, params):
-        self.curr_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.start_time = int(round(1000 * time.time()))
-        self.timings.append(
-            {
-                "method": method,
-                "path": url,
-                "params": params,
-                "start_time": self.start_time,
-                "end_time": None,
-                "date": self.curr_date,
-            }
-        )
-
-    def end(self, status_code):
-        self.end_time = int(round(1000 * time.time()))
-
-        # get last item
-        last = self.timings[-1]
-        last["end_time"] = self.end_time
-        last["status_code"] = status_code
-        last["duration"] = self.end_time - last["start_time"]
-
-        return last
+        self.buckets = {}
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(v):
+        if v < SUB_COUNT:
+            return v
+
+        shift = v.bit_length() - SUB_BITS - 1
+        return ((shift + 1) << SUB_BITS) + (v >> shift) - SUB_COUNT
+
+    @staticmethod
+    def _value(idx):
+        if idx < SUB_COUNT:
+            return idx
+
+        shift = (idx >> SUB_BITS) - 1
+        return ((idx & (SUB_COUNT - 1)) + SUB_COUNT) << shift
+
+    def add(self, us, error=False, retries=0):
+        us = max(0, int(us))
+        idx = self._index(us)
+
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+        if not self.count or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+
+        self.count += 1
+        self.total += us
+        if error:
+            self.errors += 1
+        self.retries += retries
+
+    def merge(self, other):
+        for idx, n in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + n
+
+        if other.count and (not self.count or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+        self.count += other.count
+        self.total += other.total
+        self.errors += other.errors
+        self.retries += other.retries
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+
+        # nearest rank: the smallest value with at least p% of the values <= it
+        rank = max(1, math.ceil(p * self.count / 100.0))
+
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return min(max(self._value(idx), self.min), self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class Timings:
+    """
+    The timings of all the requests.
+
+    In "full" mode every request is a row stored in a set of arrays (one
+    per column), with method and path interned. Request params are kept
+    only when `params` is True.
+
+    In "aggregate" mode nothing is stored per request: durations are counted
+    in a Histogram per endpoint (method + path), so memory stays flat.
+
+    Times are measured with time.perf_counter_ns() and stored in nanoseconds.
+
+    When `profile` is True, the per-phase timings of every request (see
+    Profiler) are stored too, and exported as additional CSV columns.
+    """
+
+    def __init__(self, mode="full", params=True, profile=False):
+        self.mode = mode
+        self.keep_params = params
+        self.profile = profile
+
+        # interned strings
+        self._strings = []
+        self._ids = {}
+
+        # columns (full mode)
+        self.methods = array("I")
+        self.paths = array("I")
+        self.starts = array("q")  # wall clock time (ns)
+        self.durations = array("q")  # ns, -1 until the request ends
+        self.statuses = array("H")
+        self.retries = array("H")  # 2.4.0 - retries of the request
+        self.retry_durations = array("q")  # 2.4.0 - ns spent retrying
+        self.params = []
+        self.profiles = []
+
+        # (method, path) -> Histogram (aggregate mode)
+        self.histograms = {}
+
+        # perf_counter_ns() is used for measuring, the wall clock only to date rows
+        self._wall = time.time_ns()
+        self._perf = time.perf_counter_ns()
+
+        self._curr = None
+
+    def new(self):
+        # an empty Timings with the same settings (for parallel workers)
+        return Timings(self.mode, self.keep_params, self.profile)
+
+    def __len__(self):
+        if self.mode == "aggregate":
+            return sum(h.count for h in self.histograms.values())
+
+        return len(self.starts)
+
+    def _intern(self, s):
+        idx = self._ids.get(s)
+        if idx is None:
+            idx = len(self._strings)
+            self._strings.append(s)
+            self._ids[s] = idx
+
+        return idx
+
+    def start(self, method, url, params, profile=None):
+        self._curr = (self._intern(method), self._intern(url), time.perf_counter_ns())
+
+        if self.mode == "aggregate":
+            return
+
+        self.methods.append(self._curr[0])
+        self.paths.append(self._curr[1])
+        self.starts.append(self._wall + self._curr[2] - self._perf)
+        self.durations.append(-1)
+        self.statuses.append(0)
+        self.retries.append(0)
+        self.retry_durations.append(0)
+
+        if self.keep_params:
+            self.params.append(params)
+
+        if self.profile:
+            self.profiles.append(profile)
+
+    def end(self, status_code, wait_ns=0, retries=0, retry_ns=0):
+        # returns the duration of the last request, in milliseconds
+        # (2.4.0 - the time waited for the rate limiter is not included,
+        #  the time spent retrying is, and it is also recorded on its own)
+        method, path, start = self._curr
+        duration = time.perf_counter_ns() - start - wait_ns
+
+        if self.mode == "aggregate":
+            key = (self._strings[method], self._strings[path])
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+
+            h.add(duration // 1000, status_code >= 400, retries)
+        else:
+            self.durations[-1] = duration
+            self.statuses[-1] = status_code
+            self.retries[-1] = retries
+            self.retry_durations[-1] = retry_ns
+
+        return duration / 1000000
+
+    # 2.4.0 - merge the timings recorded by a parallel worker
+    def merge(self, other):
+        for key, h in other.histograms.items():
+            if key in self.histograms:
+                self.histograms[key].merge(h)
+            else:
+                self.histograms[key] = h
+
+        if not len(other.starts):
+            return
+
+        # rows of a Timings are always sorted: sort again only if they overlap
+        overlap = len(self.starts) and other.starts[0] < self.starts[-1]
+
+        remap = [self._intern(s) for s in other._strings]
+
+        self.methods.extend(remap[i] for i in other.methods)
+        self.paths.extend(remap[i] for i in other.paths)
+        self.starts.extend(other.starts)
+        self.durations.extend(other.durations)
+        self.statuses.extend(other.statuses)
+        self.retries.extend(other.retries)
+        self.retry_durations.extend(other.retry_durations)
+        self.params.extend(other.params)
+        self.profiles.extend(other.profiles)
+
+        if overlap:
+            self._sort()
+
+    def _sort(self):
+        order = sorted(range(len(self.starts)), key=self.starts.__getitem__)
+
+        for name in (
+            "methods",
+            "paths",
+            "starts",
+            "durations",
+            "statuses",
+            "retries",
+            "retry_durations",
+        ):
+            col = getattr(self, name)
+            setattr(self, name, array(col.typecode, (col[i] for i in order)))
+
+        if self.params:
+            self.params = [self.params[i] for i in order]
+
+        if self.profiles:
+            self.profiles = [self.profiles[i] for i in order]
 
     def export_csv(self, filename):
+        if self.mode == "aggregate":
+            return self._export_aggregate(filename)
+
+        with open(filename, "w") as f:
+            f.write(
+                "method\tpath\tparams\tstart_time\tend_time\tdate\tstatus_code\tduration\tduration_s"
+            )
+            # 2.4.0 - retries
+            f.write("\tretries\tretry_ms")
+            # 2.4.0 - per-phase timings (in ms) with --profile
+            if self.profile:
+                f.write("".join("\t%s_ms" % p for p in PHASES))
+            f.write("\n")
+
+            for i in range(len(self.starts)):
+                # requests that did not complete have no end time
+                if self.durations[i] < 0:
+                    continue
+
+                start = self.starts[i] // 1000000
+                duration = self.durations[i] / 1000000
+
+                f.write(
+                    "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%.3f\t%.6f"
+                    % (
+                        self._strings[self.methods[i]],
+                        self._strings[self.paths[i]],
+                        self.params[i] if self.keep_params else "",
+                        start,
+                        start + int(round(duration)),
+                        datetime.datetime.fromtimestamp(start / 1000).strftime(
+                            "%Y-%m-%d %H:%M:%S"
+                        ),
+                        self.statuses[i],
+                        duration,
+                        duration / 1000,
+                    )
+                )
+                f.write(
+                    "\t%s\t%.3f" % (self.retries[i], self.retry_durations[i] / 1000000)
+                )
+
+                if self.profile:
+                    f.write(self._profile_cols(self.profiles[i]))
+                f.write("\n")
+
+    def _profile_cols(self, profile):
+        if profile is None:
+            return "\t" * len(PHASES)
+
+        return "".join("\t%.3f" % (profile[p] / 1000000) for p in PHASES)
+
+    def _export_aggregate(self, filename):
         with open(filename, "w") as f:
             f.write(
-                "method\tpath\tparams\tstart_time\tend_time\tdate\tstatus_code\tduration\tduration_s\n"
+                "method\tpath\tcount\terrors\tmin\tmean\tp50\tp90\tp99\tmax\tretries\n"
             )
 
-            for t in self.timings:
+            for (method, path), h in self.histograms.items():
                 f.write(
-                    "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n"
+                    "%s\t%s\t%s\t%s\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%s\n"
                     % (
-                        t["method"],
-                        t["path"],
-                        t["params"],
-                        t["start_time"],
-                        t["end_time"],
-                        t["date"],
-                        t["status_code"],
-                        t["duration"],
-                        t["duration"] / 1000,
+                        method,
+                        path,
+                        h.count,
+                        h.errors,
+                        h.min / 1000,
+                        h.mean() / 1000,
+                        h.percentile(50) / 1000,
+                        h.percentile(90) / 1000,
+                        h.percentile(99) / 1000,
+                        h.max / 1000,
+                        h.retries,
                     )
                 )
@@ -17,3 +17,16 @@ def size2str(size):
         return str(size // 1024 // 1024) + "MB"
     else:
         return str(size // 1024 // 1024 // 1024) + "GB"
+
+
+def str2size(size):
+    # 2.4.0 - the inverse of size2str(): "10MB" -> 10485760
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    size = str(size).strip().upper()
+    for i, unit in enumerate(("GB", "MB", "KB", "B")):
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * 1024 ** (3 - i))
+
+    return int(size)
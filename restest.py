@@ -9,11 +9,217 @@ VERSION = "2.4.0"
 
 import argparse
 import os
+import sys
 import time
 import json
+from concurrent.futures import ProcessPoolExecutor
 
+from lib.deadline import DEADLINE_EXIT_CODE, Deadline, DeadlineExceeded
 from lib.parser import RESTestParser
 from lib.postman_exp import PostmanExporter
+from lib.results import shard_name
+
+
+def _mk_postman(args):
+    if not args.postman:
+        return None
+
+    return PostmanExporter(
+        args.postman,
+        args.postman_name,
+        args.postman_base_url,
+        args.postman_auth_name,
+        args.postman_auth_value,
+    )
+
+
+def _mk_parser(
+    args,
+    postman,
+    log_clean=False,
+    results=None,
+    record=None,
+    replay=None,
+    rate_share=1,
+    deadline=None,
+):
+    return RESTestParser(
+        quiet=args.quiet,
+        base_url=args.base_url,
+        stop_on_error=not args.dont_stop_on_error,
+        log_file=args.log,
+        postman=postman,
+        curl=args.curl,
+        dry=args.dry,
+        delay=args.delay,
+        no_colors=args.no_colors,
+        prefix=args.prefix,
+        auth_mode=args.auth_mode,
+        log_clean=log_clean,  # 2.2.0 - Added log_clean
+        debug_file_name=args.debug_file_name,  # 2.4.0 - Added debug_file_name
+        jobs=args.jobs,  # 2.4.0 - Added jobs
+        engine=args.engine,  # 2.4.0 - Added engine
+        log_max_size=args.log_max_size,  # 2.4.0 - Added log rotation
+        log_gzip=args.log_gzip,  # 2.4.0 - Added log rotation
+        cache_dir="" if args.no_cache else args.cache_dir,  # 2.4.0 - Added cache
+        timings=args.timings,  # 2.4.0 - Added aggregate timings
+        timings_params=not args.timings_no_params,  # 2.4.0 - Added aggregate timings
+        results=args.results if results is None else results,  # 2.4.0 - Added results
+        profile=args.profile,  # 2.4.0 - Added profiling
+        record=record if record is not None else args.record,  # 2.4.0 - Added cassettes
+        replay=replay if replay is not None else args.replay,  # 2.4.0 - Added cassettes
+        rate=args.rate,  # 2.4.0 - Added rate limits
+        rate_share=rate_share,  # 2.4.0 - Added rate limits
+        deadline=deadline,  # 2.4.0 - Added run deadline
+        pool={  # 2.4.0 - Added connection pool settings
+            "pool_connections": args.pool_connections,
+            "pool_maxsize": args.pool_maxsize,
+            "max_connections": args.max_connections,
+            "keep_alive": False if args.no_keep_alive else None,
+        },
+    )
+
+
+def _seed_globals(rt, args):
+    if args.env_load:
+        try:
+            data = json.loads(open(args.env_load).read())
+            for k, v in data.items():
+                rt.rt.globals[k.lower()] = v
+        except:  # noqa
+            pass
+
+    if args.env:
+        for k, v in os.environ.items():
+            rt.rt.globals[k.lower()] = v
+
+    if args.key:
+        for c in args.key:
+            k, v = c.split(":")
+            rt.rt.globals[k] = v
+
+
+def _run_file(args, fname, shard, deadline=None):
+    # 2.4.0 - runs one file in a worker process and returns its results
+    postman = _mk_postman(args)
+    # every worker writes its results in its own files
+    results = [shard_name(r, shard) for r in args.results or []]
+
+    # cassettes are recorded in one file per worker, and replayed from it (if present)
+    record = shard_name(args.record, shard) if args.record else None
+    replay = args.replay
+    if replay and os.path.exists(shard_name(replay, shard)):
+        replay = shard_name(replay, shard)
+
+    # rate limits are shared by the processes running at the same time
+    rate_share = min(args.processes, len(args.file))
+
+    rt = _mk_parser(
+        args,
+        postman,
+        results=results,
+        record=record,
+        replay=replay,
+        rate_share=rate_share,
+        deadline=deadline,
+    )
+    _seed_globals(rt, args)
+
+    exit_code = 0
+    try:
+        rt.open(fname)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+
+    rt.close()
+
+    return {
+        "tests": rt.rt._tests,
+        "errors": rt.rt._errors,
+        "timings": rt.timings,
+        "connections": (rt.rt.conn_stats.requests, rt.rt.conn_stats.new),
+        "cache": (
+            rt.rt.cache_stats.hits,
+            rt.rt.cache_stats.misses,
+            rt.rt.cache_stats.revalidated,
+        ),
+        "rate": (
+            rt.rt.rate_stats.requests,
+            rt.rt.rate_stats.delayed,
+            rt.rt.rate_stats.wait_ns,
+            rt.rt.rate_stats.max_wait_ns,
+        ),
+        "retry": (
+            rt.rt.retry_stats.retries,
+            rt.rt.retry_stats.requests,
+            rt.rt.retry_stats.retry_ns,
+            rt.rt.retry_stats.fast_fails,
+        ),
+        "profiler": rt.rt.profiler,
+        "postman": postman.items if postman else [],
+        "globals": dict(rt.rt.globals),
+        "exit_code": exit_code,
+    }
+
+
+def _run_processes(args, rt, postman, deadline=None):
+    # 2.4.0 - every file runs in a worker process, results are merged in file order
+    exit_code = 0
+
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = [
+            pool.submit(_run_file, args, f, i + 1, deadline)
+            for i, f in enumerate(args.file)
+        ]
+
+        def stop(f):
+            # like a single process, the run stops at the first error: the files
+            # not started yet are cancelled (the running ones are completed)
+            if not f.cancelled() and (f.exception() or f.result()["exit_code"]):
+                for p in futures:
+                    p.cancel()
+
+        if not args.dont_stop_on_error:
+            for f in futures:
+                f.add_done_callback(stop)
+
+        for fname, f in zip(args.file, futures):
+            # files not started after a stop on error
+            if f.cancelled():
+                continue
+
+            try:
+                res = f.result()
+            except Exception as e:
+                # a crashed worker does not lose the results of the other files
+                sys.stderr.write("\n\n=== ERROR: %s: %s\n" % (fname, e))
+                rt.rt._errors += 1
+                code = 1
+            else:
+                rt.rt._tests += res["tests"]
+                rt.rt._errors += res["errors"]
+                rt.rt.globals.update(res["globals"])
+                rt.timings.merge(res["timings"])
+                rt.rt.conn_stats.add(*res["connections"])
+                rt.rt.cache_stats.add(*res["cache"])
+                rt.rt.rate_stats.add(*res["rate"])
+                rt.rt.retry_stats.add(*res["retry"])
+                rt.rt.profiler.merge(res["profiler"])
+
+                if postman:
+                    postman.items.extend(res["postman"])
+
+                # the error stopping a worker is not counted by the worker
+                # (a deadline hit is not an error, like in a single process)
+                code = res["exit_code"]
+                if code and code != DEADLINE_EXIT_CODE:
+                    rt.rt._errors += 1
+
+            # a deadline hit stops the whole run, so it wins over the errors
+            if code == DEADLINE_EXIT_CODE or not exit_code:
+                exit_code = code
+
+    return exit_code
 
 
 def main():
@@ -35,12 +241,22 @@ def main():
         type=str,
         help="Base URL. This string overrides the 'system' parameter in JSON file",
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory for the compiled scripts cache (defaults to ~/.cache/restest)",
+    )
     parser.add_argument("--csv", type=str, help="Export results to a CSV file")
     parser.add_argument(
         "--curl",
         action="store_true",
         help="Dumps CURL also on console (defaults on log only",
     )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Max run time in seconds: outstanding requests are cancelled and the run stops (exit code 124), logs and exports are still saved",
+    )
     parser.add_argument(
         "--delay", type=int, help="Delay in milliseconds between requests"
     )
@@ -57,6 +273,13 @@ def main():
     parser.add_argument(
         "--dry", action="store_true", help="If set, no request is done for real"
     )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["sync", "async"],
+        default="sync",
+        help="HTTP engine. Choose between 'sync' (requests) or 'async' (aiohttp), defaults to 'sync'",
+    )
     parser.add_argument(
         "--env",
         action="store_true",
@@ -72,6 +295,12 @@ def main():
         type=str,
         help="If set, global vars will be saved to specified file",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Number of workers used by sections with 'parallel' set (defaults to 4)",
+    )
     parser.add_argument(
         "--key",
         type=str,
@@ -86,11 +315,37 @@ def main():
         action="store_true",
         help="Clean the logfile before starting",
     )
+    parser.add_argument(
+        "--log-gzip",
+        action="store_true",
+        help="Compress the rotated log files with gzip",
+    )
+    parser.add_argument(
+        "--log-max-size",
+        type=str,
+        default="0",
+        help="Rotate the log file when it grows bigger than this size (eg. 100MB)",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        help="Max number of simultaneous connections of the async engine (defaults to 1000, 0 means no limit)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="If set, compiled scripts are not cached on disk",
+    )
     parser.add_argument(
         "--no-colors",
         action="store_true",
         help="If set, colors in console output are disabled",
     )
+    parser.add_argument(
+        "--no-keep-alive",
+        action="store_true",
+        help="If set, every request uses a new connection",
+    )
     parser.add_argument(
         "--postman", type=str, help="Export activity to a Postman JSON file"
     )
@@ -106,38 +361,86 @@ def main():
         help="The base url to use in Postman instead of the real host",
     )
     parser.add_argument("--postman-name", type=str, help="The Postman Collection name")
+    parser.add_argument(
+        "--pool-connections",
+        type=int,
+        help="Number of hosts kept in the connection pool (defaults to 10)",
+    )
+    parser.add_argument(
+        "--pool-maxsize",
+        type=int,
+        help="Connections per host kept in the pool (defaults to 100, no limit with the async engine)",
+    )
     parser.add_argument("--prefix", type=str, help="The API prefix URL")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes used to run the test files (defaults to 1)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="If set, every phase of every request is timed, and reported at the end (and in the CSV export)",
+    )
     parser.add_argument(
         "--quiet", action="store_true", help="If set, no output on console"
     )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Max number of requests per second (overrides the 'rps' of 'rate' in 'system')",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        help="Record every request and response to a cassette file (.jsonl)",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        help="Replay the responses from a cassette file (.jsonl) recorded with --record, instead of using the network",
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        action="append",
+        help="Stream every request and test result to a file: .jsonl, .csv or .xml (JUnit). Can be repeated",
+    )
+    parser.add_argument(
+        "--timings",
+        type=str,
+        choices=["full", "aggregate"],
+        default="full",
+        help="How timings are recorded: 'full' (one row per request) or 'aggregate' (latency histograms per endpoint), defaults to 'full'",
+    )
+    parser.add_argument(
+        "--timings-no-params",
+        action="store_true",
+        help="If set, request params are not recorded in timings (and in the CSV export)",
+    )
     parser.add_argument("--version", action="version", version=f"v{VERSION}")
 
     args = parser.parse_args()
 
-    postman = None
-    if args.postman:
-        postman = PostmanExporter(
-            args.postman,
-            args.postman_name,
-            args.postman_base_url,
-            args.postman_auth_name,
-            args.postman_auth_value,
-        )
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be used together")
 
-    rt = RESTestParser(
-        quiet=args.quiet,
-        base_url=args.base_url,
-        stop_on_error=not args.dont_stop_on_error,
-        log_file=args.log,
-        postman=postman,
-        curl=args.curl,
-        dry=args.dry,
-        delay=args.delay,
-        no_colors=args.no_colors,
-        prefix=args.prefix,
-        auth_mode=args.auth_mode,
-        log_clean=args.log_clean,  # 2.2.0 - Added log_clean
-        debug_file_name=args.debug_file_name,  # 2.4.0 - Added debug_file_name
+    # 2.4.0 - with multiple processes, results are written by the workers
+    multi = args.processes > 1 and len(args.file) > 1
+
+    # 2.4.0 - the deadline starts now, and is shared by the worker processes
+    deadline = Deadline(args.deadline) if args.deadline else None
+
+    postman = _mk_postman(args)
+    rt = _mk_parser(
+        args,
+        postman,
+        deadline=deadline,
+        log_clean=args.log_clean,
+        results=[] if multi else None,
+        record="" if multi else None,
+        replay="" if multi else None,
     )
 
     args = parser.parse_args()
@@ -168,28 +471,25 @@ def main():
     )
     """
 
-    if args.env_load:
-        try:
-            data = json.loads(open(args.env_load).read())
-            for k, v in data.items():
-                rt.rt.globals[k.lower()] = v
-        except:  # noqa
-            pass
-
-    if args.env:
-        for k, v in os.environ.items():
-            rt.rt.globals[k.lower()] = v
-
-    if args.key:
-        for c in args.key:
-            k, v = c.split(":")
-            rt.rt.globals[k] = v
+    _seed_globals(rt, args)
 
     start_time = time.time()
-    for f in args.file:
-        rt.open(f)
+    exit_code = 0
+
+    # 2.4.0 - support for multiple processes
+    try:
+        if multi:
+            exit_code = _run_processes(args, rt, postman, deadline)
+        else:
+            for f in args.file:
+                rt.open(f)
+    except DeadlineExceeded as e:
+        # 2.4.0 - the run is stopped, but logs and exports are still saved
+        exit_code = e.code
 
     end_time = time.time()
+    rt.close()
+
     total_time = int((end_time - start_time) * 1000) / 1000.0
 
     if postman:
@@ -200,12 +500,39 @@ def main():
         % (rt.rt._errors, rt.rt._tests, total_time)
     )
 
+    # 2.4.0 - connection reuse stats
+    if rt.rt.conn_stats.requests:
+        print("===== CONNECTIONS: %s" % rt.rt.conn_stats.summary())
+
+    # 2.4.0 - HTTP cache stats
+    if rt.rt.cache_stats:
+        print("===== HTTP CACHE: %s" % rt.rt.cache_stats.summary())
+
+    # 2.4.0 - rate limiter stats
+    if rt.rt.rate_stats:
+        print("===== RATE LIMIT: %s" % rt.rt.rate_stats.summary())
+
+    # 2.4.0 - retries and circuit breaker stats
+    if rt.rt.retry_stats:
+        print("===== RETRIES: %s" % rt.rt.retry_stats.summary())
+
+    # 2.4.0 - the run was stopped by --deadline
+    if exit_code == DEADLINE_EXIT_CODE:
+        print("===== DEADLINE: run stopped after %s s" % args.deadline)
+
+    # 2.4.0 - per-phase profiling
+    if rt.rt.profiler:
+        print(rt.rt.profiler.report())
+
     if args.env_save:
         open(args.env_save, "w").write(json.dumps(rt.rt.globals, indent=4, default=str))
 
     if args.csv:
         rt.export_csv(args.csv)
 
+    if exit_code:
+        sys.exit(exit_code)
+
 
 if __name__ == "__main__":
     main()
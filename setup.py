@@ -45,6 +45,10 @@ setup(
         "termcolor",
         "requests",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "numpy": ["numpy"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lib.assertions import compile_assertion
+
+
+class _Engine:
+    no_colors = True
+
+    def _expand_var(self, v):
+        return v
+
+
+def _run(mode, current, value=None):
+    return compile_assertion({"mode": mode, "value": value}).run(_Engine(), "f", current)
+
+
+def test_null_elements():
+    assert "element [1] = None" in _run("SUM", [1, None, 3], 4)
+    assert "element [1] = None" in _run("SORTED", [1, None, 3])
+    assert "element [0] = None" in _run("SORTED", [None, 1, 2], "DESC")
+    assert "first failing: [1] = None" in _run("ALL", [1, None, 3], "GT:0")
+
+    assert _run("ANY", [1, None, 3], "GT:2") is None
+    assert _run("SUM", [1, 2, 3], 6) is None
+
+
+def test_condition_value():
+    assert _run("ALL", ["active", "active"], "active") is None
+    assert _run("ALL", ["active", "active"], "EQUALS:active") is None
+    assert _run("ANY", ["a:b", "c"], "a:b") is None
+    assert _run("COUNT", [1, 2, 3], "3") is None
+    assert "first failing: [1] = off" in _run("ALL", ["active", "off"], "active")
+    assert "unsupported test mode" in _run("ALL", [1], {"mode": "FOO", "value": 1})
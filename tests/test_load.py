@@ -0,0 +1,44 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lib.load import LoadRunner
+
+
+class _Engine:
+    def __init__(self):
+        self.log = []
+
+    def _log_write(self, txt):
+        self.log.append(txt)
+
+
+class _Parser:
+    quiet = True
+
+    def __init__(self):
+        self.rt = _Engine()
+
+    def _exec_args(self, act):
+        return {}
+
+
+def test_report_percentiles():
+    p = _Parser()
+    lr = LoadRunner(p, {"method": "get", "url": "/x", "repeat": 10})
+
+    # 1..10 ms
+    for ms in range(1, 11):
+        lr.latencies.add(ms * 1000)
+
+    lr.report(1.0)
+
+    txt = "".join(p.rt.log)
+    assert "requests: 10 - errors: 0" in txt
+
+    # latencies are bucketed, within 1%
+    got = dict(re.findall(r"(p\d+|max): ([\d.]+)", txt))
+    for k, v in (("p50", 5), ("p90", 9), ("p99", 10), ("max", 10)):
+        assert abs(float(got[k]) - v) <= v / 100.0, (k, got[k])
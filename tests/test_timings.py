@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lib.timings import Histogram
+
+
+def _histogram(values):
+    h = Histogram()
+    for v in values:
+        h.add(v)
+
+    return h
+
+
+def test_percentile_nearest_rank():
+    h = _histogram(range(1, 11))
+
+    assert h.percentile(50) == 5
+    assert h.percentile(90) == 9
+    assert h.percentile(100) == 10
+
+    h = _histogram(range(1, 101))
+
+    assert h.percentile(7) == 7
+    assert h.percentile(99) == 99
+
+
+def test_percentile_ms():
+    # values in microseconds: bucketed, but within 1%
+    h = _histogram(range(1000, 10001, 1000))
+
+    assert abs(h.percentile(50) - 5000) <= 50
+    assert abs(h.percentile(90) - 9000) <= 90
+
+    h = _histogram(range(1000, 100001, 1000))
+
+    assert abs(h.percentile(99) - 99000) <= 990
+    assert h.percentile(99) < h.max
+
+
+def test_percentile_empty():
+    assert Histogram().percentile(50) == 0